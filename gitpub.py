@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
 import optparse
+import sys
+import time
 from gitpublish import core
 try:
     import getpass
@@ -33,7 +35,7 @@ class Interface(object):
 
     def remote_list(self):
         'get a list of gpremotes'
-        branches = [s for s in self.localRepo.list_branches() if
+        branches = [s for s in self.localRepo.branches if
                     s.startswith('gpremotes/')]
         remotes = set()
         for branch in branches:
@@ -72,8 +74,7 @@ class Interface(object):
     def add(self, paths, **docDict):
         'add file to mapping to be published on remote'
         tb = self.get_tracking_branch()
-        for path in paths:
-            tb.add(path, **docDict)
+        tb.add_paths(paths, **docDict)
         tb.save_stage()
 
     def rm(self, paths):
@@ -93,22 +94,24 @@ class Interface(object):
         self.on_remote_branch() # make sure we're on remote tracking branch
         self.localRepo.commit(message)
 
-    def fetch(self, remoteName=None, branchName='master'):
+    def fetch(self, remoteName=None, branchName='master', maxWorkers=1):
         'fetch latest changes from remote, commit to tracking branch'
         tb = self.get_tracking_branch(remoteName, branchName)
-        tb.fetch()
+        tb.fetch(maxWorkers)
 
-    def push(self, remoteName=None, branchName='master'):
+    def push(self, remoteName=None, branchName='master', maxWorkers=1,
+             rehash=False, gitChanges=False):
         'push mapped documents from this tracking branch to publish on remote'
         tb = self.get_tracking_branch(remoteName, branchName)
-        tb.push()
+        tb.push(maxWorkers=maxWorkers, rehash=rehash, gitChanges=gitChanges)
 
-    def merge(self, branchName=None, updateOnly=False):
+    def merge(self, branchName=None, updateOnly=False, rehash=False,
+              gitChanges=False):
         'merge changes from this tracking branch'
         tb = self.get_tracking_branch()
         if not branchName:
             branchName = tb.branchName.split('/')[-1]
-        tb.merge(branchName, updateOnly)
+        tb.merge(branchName, updateOnly, rehash, gitChanges)
 
 
 def get_options():
@@ -122,20 +125,43 @@ def get_options():
 i.e. skip its automatic merge step.  Only use this option if you
 manually merged in changes from your local branch to your
 gpremotes/ tracking branch, before running gitpublish merge.''')
+    parser.add_option(
+        '--rehash', action="store_true", dest="rehash", default=False,
+        help='''Make gitpublish merge / push re-read and rehash every mapped
+file, instead of only files whose size, mtime or inode changed.''')
+    parser.add_option(
+        '--git-changes', action="store_true", dest="gitChanges", default=False,
+        help='''Make gitpublish merge / push take every file's blob ID from
+git (one git diff-index call), and skip reading files whose blob ID
+matches the one recorded in the doc map.  Files edited but not yet
+git added are still read.''')
     parser.add_option(
         '-m', action="store", type="string",
         dest="message", 
         help="message to store for this commit")
+    parser.add_option(
+        '-j', '--jobs', action="store", type="int", dest="maxWorkers",
+        default=1,
+        help='''number of documents gitpub push sends to (or gitpub fetch
+downloads from) the remote concurrently''')
     parser.add_option(
         '--docarg', action='append', dest='docargs', default=[],
         help='''optional doc arguments for gitpub add:
         pubtype="post|page" ... for wordpress, sets the publication type''')
+    parser.add_option(
+        '--profile', action="store_true", dest="profile", default=False,
+        help='''print how long the command spent in git, docutils rendering,
+html2rest, remote requests and docmap load / save''')
+    parser.add_option(
+        '--profile-file', action="store", type="string", dest="profileFile",
+        help='''run the command under cProfile and save its stats to this
+file (for pstats).  Implies --profile''')
     return parser.parse_args()
 
 
 
-if __name__ == '__main__':
-    options, args = get_options()
+def main(options, args):
+    'run the gitpub command given by args'
     cmd = args[0]
     args = args[1:]
     gp = Interface()
@@ -162,12 +188,32 @@ if __name__ == '__main__':
     elif cmd == 'commit':
         gp.commit(options.message)
     elif cmd == 'fetch':
-        gp.fetch(*args)
+        gp.fetch(maxWorkers=options.maxWorkers, *args)
     elif cmd == 'push':
-        gp.push(*args)
+        gp.push(maxWorkers=options.maxWorkers, rehash=options.rehash,
+                gitChanges=options.gitChanges, *args)
     elif cmd == 'merge':
         if len(args) > 1:
             raise ValueError('usage: gitpublish merge [local-branch-name]')
-        gp.merge(updateOnly=options.updateOnly, *args)
+        gp.merge(updateOnly=options.updateOnly, rehash=options.rehash,
+                 gitChanges=options.gitChanges, *args)
     else:
         raise ValueError('not a valid command: remote, checkout, add, rm, mv, commit, fetch, push, merge')
+
+
+if __name__ == '__main__':
+    options, args = get_options()
+    start = time.time()
+    try:
+        if options.profileFile:
+            import cProfile
+            profile = cProfile.Profile()
+            try:
+                profile.runcall(main, options, args)
+            finally:
+                profile.dump_stats(options.profileFile)
+        else:
+            main(options, args)
+    finally:
+        if options.profile or options.profileFile:
+            print >>sys.stderr, core.format_phase_times(time.time() - start)
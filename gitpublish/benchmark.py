@@ -0,0 +1,665 @@
+'''Benchmarks for gitpublish's slow paths.  Run from the top of the
+source tree, e.g.
+
+  python -m gitpublish.benchmark html2rest
+
+prints a JSON dict of results for each benchmark named (default: all).
+'''
+
+import codecs
+import glob
+import json
+import multiprocessing
+import optparse
+import os
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from StringIO import StringIO
+
+from gitpublish.plugin.translator import html2rest
+
+srcDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+docDir = os.path.join(srcDir, 'doc')
+
+def best_time(func, repeat=3):
+    'run func() repeat times, return (fastest time in seconds, last result)'
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func()
+        t = time.time() - start
+        if best is None or t < best:
+            best = t
+    return best, result
+
+def get_html_corpus(paths=None):
+    'render .rst files (default: our doc/ directory) to list of HTML strings'
+    from docutils.core import publish_string
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(docDir, '*.rst')) +
+                       glob.glob(os.path.join(docDir, '*', '*.rst')))
+    l = []
+    for path in paths:
+        ifile = codecs.open(path, 'r', 'utf8')
+        try:
+            rest = ifile.read()
+        finally:
+            ifile.close()
+        html = publish_string(rest, writer_name='html',
+                              settings_overrides=dict(report_level=5))
+        l.append(html.decode('utf8'))
+    return l
+
+def convert_html(parserClass, html, chunkSize=0):
+    'convert html to ReST using parserClass, fed chunkSize chars at a time'
+    buf = StringIO()
+    parser = parserClass(buf)
+    if chunkSize:
+        for i in range(0, len(html), chunkSize):
+            parser.feed(html[i:i + chunkSize])
+    else:
+        parser.feed(html)
+    parser.close()
+    return buf.getvalue()
+
+def bench_html2rest(options):
+    'throughput of SGMLParser-based html2rest.Parser vs. StreamParser'
+    corpus = get_html_corpus(options.paths) * options.scale
+    nbytes = sum([len(html) for html in corpus])
+    results = dict(docs=len(corpus), bytes=nbytes)
+    outputs = {}
+    for name, parserClass, chunkSize in (('Parser', html2rest.Parser, 0),
+            ('StreamParser', html2rest.StreamParser, 0),
+            ('StreamParser-chunked', html2rest.StreamParser, 4096)):
+        t, outputs[name] = best_time(lambda: [convert_html(parserClass, html,
+                                                           chunkSize)
+                                              for html in corpus],
+                                     options.repeat)
+        results[name] = dict(seconds=t, bytes_per_sec=nbytes / t)
+    results['speedup'] = results['Parser']['seconds'] \
+                         / results['StreamParser']['seconds']
+    results['identical'] = outputs['Parser'] == outputs['StreamParser'] \
+                           == outputs['StreamParser-chunked']
+    return results
+
+def get_nested_list_html(nitems, depth=6):
+    'HTML with nitems lists nested depth deep, with text at every level'
+    l = []
+    for i in range(nitems):
+        l.append('<ul>' * depth)
+        for level in range(depth):
+            l.append('<li>' + ('item %d level %d with some <b>bold</b> text '
+                               '&amp; words ' % (i, level)) * 3 + '<ul>')
+        l.append('<li>leaf</li>' + '</ul></li>' * depth + '</ul>' * depth)
+        l.append('<p>paragraph %d</p>' % i)
+    return ''.join(l)
+
+def _convert_nested_lists(nitems, repeat, q):
+    'child process for bench_nested_lists: report time and peak memory'
+    html = get_nested_list_html(nitems)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t, rest = best_time(lambda: convert_html(html2rest.StreamParser, html),
+                        repeat)
+    q.put(dict(bytes=len(html), seconds=t,
+               maxrss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               maxrss_growth_kb=resource.getrusage(resource.RUSAGE_SELF)
+               .ru_maxrss - maxrss))
+
+def bench_nested_lists(options):
+    '''html2rest time and peak memory on nested-list-heavy HTML, doubling
+    its size each step; each should grow linearly with size'''
+    results = []
+    for i in range(4):
+        q = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_convert_nested_lists,
+                                    args=(options.scale * 10 * 2 ** i,
+                                          options.repeat, q))
+        p.start()
+        d = q.get()
+        p.join()
+        d['usec_per_kb'] = 1e6 * d['seconds'] / (d['bytes'] / 1024.)
+        results.append(d)
+    return results
+
+moinLines = (
+    "= Page Title =\n",
+    "Plain text with nothing special in it at all, just words.\n",
+    "Some ''italic'' and '''bold''' text and '''''both''''' here.\n",
+    "See [[http://example.com|example site]] and [[http://foo.org]].\n",
+    "An internal [[FrontPage|front page]] link, [[FrontPage]] and RecentChanges.\n",
+    " * a list item with ''emphasis'' and a '''WikiWord'''.\n",
+    " * inline {{{x = 1}}} code, and math $$E = mc^2$$ too.\n",
+    " * quotes in {{{a ''b''}}} code and $$x_''i''$$ math.\n",
+    "Emphasis ''with a WikiWord'' inside.\n",
+    " 1. a numbered item\n",
+    "A code block {{{\n",
+    "x = ''1''\n",
+    "}}}\n",
+    "\n",
+    )
+
+def get_moin_page(nlines):
+    'Moin markup text of nlines lines'
+    return ''.join([moinLines[i % len(moinLines)] for i in range(nlines)])
+
+def get_moin_pages(path):
+    'list of (name, Moin markup text) for every file under directory path'
+    l = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            ifile = open(os.path.join(dirpath, filename))
+            try:
+                l.append((os.path.join(dirpath, filename), ifile.read()))
+            finally:
+                ifile.close()
+    return l
+
+def get_reference_reformatters():
+    '''the original nine patterns, each applied in turn to the output of
+    the one before, as moin.reformat_line() did before it was optimized'''
+    import re
+    from gitpublish.plugin import moin
+    return [
+        (re.compile(r"\$\$.+?\$\$"), lambda s: ":math:`%s`" % s[2:-2]),
+        (re.compile(r"'''''.+?'''''"), lambda s: "**%s**" %s[5:-5]),
+        (re.compile(r"'''.+?'''"), lambda s: "**%s**" %s[3:-3]),
+        (re.compile(r"''.+?''"), lambda s: "*%s*" %s[2:-2]),
+        (re.compile(r"{{{.+?}}}"), lambda s: "``%s``" %s[3:-3]),
+        (re.compile(r"\[\[[A-Z]+[a-z0-9]+[A-Z][A-Za-z0-9]+\|.+?\]\]"),
+         moin.rest_internal_link),
+        (re.compile(r"\[\[[A-Z]+[a-z0-9]+[A-Z][A-Za-z0-9]+\]\]"),
+         lambda s: ':doc:`%s`' % s[2:-2]),
+        (re.compile(r"\[\[.+?\]]"), moin.rest_url),
+        (re.compile(r"\b[A-Z]+[a-z0-9]+[A-Z][A-Za-z0-9]+[^>A-Za-z0-9]"),
+         lambda s: ' :doc:`%s`%s' % (s[:-1],s[-1])),
+    ]
+
+def convert_moin(text, reference=False):
+    '''convert Moin text to ReST (or the exception it raised), using the
+    original reformatter and textwrap.fill() if reference is True'''
+    import textwrap
+    from gitpublish.plugin import moin
+    saved = moin.reformat_line, moin.fill
+    if reference:
+        reformatters = get_reference_reformatters()
+        def reformat_line(line):
+            for pattern, rep in reformatters:
+                line = pattern.sub(lambda m: rep(m.group(0)), line)
+            return line
+        moin.reformat_line, moin.fill = reformat_line, textwrap.fill
+    buf = StringIO()
+    try:
+        moin.convert_moin_to_rest(StringIO(text), buf)
+    except StandardError, e: # e.g. [[WikiWord|a|b]], or too deep a heading
+        return repr(e)
+    finally:
+        moin.reformat_line, moin.fill = saved
+    return buf.getvalue()
+
+def bench_moin(options):
+    '''throughput of Moin to ReST conversion, plus a regression check:
+    ok is False unless moinLines, and every page under --moin-dir (e.g.
+    a MoinMoin underlay's help pages), converts exactly as it did with
+    the original reformatter and textwrap.fill()'''
+    text = get_moin_page(1000 * options.scale)
+    t, rest = best_time(lambda: convert_moin(text), options.repeat)
+    results = dict(bytes=len(text), seconds=t, bytes_per_sec=len(text) / t)
+    pages = [('moinLines', ''.join(moinLines))]
+    if options.moinDir:
+        pages += get_moin_pages(options.moinDir)
+        nbytes = sum([len(text) for name, text in pages])
+        t, rest = best_time(lambda: [convert_moin(text)
+                                     for name, text in pages], options.repeat)
+        results['pages'] = dict(pages=len(pages), bytes=nbytes, seconds=t,
+                                bytes_per_sec=nbytes / t)
+    results['differing'] = [name for name, text in pages if convert_moin(text)
+                            != convert_moin(text, reference=True)]
+    results['ok'] = results['identical'] = not results['differing']
+    return results
+
+def make_png(width, height, shade):
+    'data of a width x height greyscale PNG image'
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data \
+               + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    rows = ['\0' + ''.join([chr((shade + x * y) & 255) for x in range(width)])
+            for y in range(height)]
+    return '\x89PNG\r\n\x1a\n' \
+           + chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) \
+           + chunk('IDAT', zlib.compress(''.join(rows))) + chunk('IEND', '')
+
+def make_rest(i, ndocs, nimages):
+    'ReST text of synthetic doc i, showing two of the nimages images'
+    l = ['Benchmark document %d' % i, '=' * 30, '']
+    for j in range(5):
+        l += ['Section %d' % j, '-' * 12, '',
+              ('Paragraph %d of doc %d has *emphasis*, **strong** text, '
+               '``literal`` text and a link to `doc %d <doc%d.html>`_.  '
+               % (j, i, (i + j + 1) % ndocs, (i + j + 1) % ndocs)) * 4, '',
+              '* first item', '* second item with *emphasis*', '',
+              '::', '', '  x = %d' % j, '']
+    if nimages:
+        for k in (i % nimages, (i * 7 + 3) % nimages):
+            l += ['.. image:: ../images/img%d.png' % k, '']
+    return '\n'.join(l)
+
+def make_corpus(path, ndocs, nimages):
+    '''create a git repository at path with ndocs ReST docs under docs/
+    and nimages PNG images under images/, each doc showing two images.
+    Returns list of their paths relative to path'''
+    subprocess.check_call(('git', 'init', '-q', path))
+    for k, v in (('user.name', 'gitpublish benchmark'),
+                 ('user.email', 'benchmark@localhost')):
+        subprocess.check_call(('git', 'config', k, v), cwd=path)
+    os.mkdir(os.path.join(path, 'docs'))
+    os.mkdir(os.path.join(path, 'images'))
+    paths = []
+    for k in range(nimages):
+        paths.append('images/img%d.png' % k)
+        ofile = open(os.path.join(path, paths[-1]), 'wb')
+        try:
+            ofile.write(make_png(64, 64, k))
+        finally:
+            ofile.close()
+    for i in range(ndocs):
+        paths.append('docs/doc%d.rst' % i)
+        ofile = open(os.path.join(path, paths[-1]), 'w')
+        try:
+            ofile.write(make_rest(i, ndocs, nimages))
+        finally:
+            ofile.close()
+    subprocess.check_call(('git', 'add', 'docs', 'images'), cwd=path)
+    subprocess.check_call(('git', 'commit', '-q', '-m', 'benchmark corpus'),
+                          cwd=path)
+    return paths
+
+def _run_phase(path, phase, repoArgs, options, q):
+    '''child process for run_phase(): run phase ('setup', 'merge',
+    'push', 'fetch' or 'rm') in the repository at path, report time, peak
+    memory and core.phaseTimes'''
+    try:
+        from gitpublish import core
+        core.import_plugin('wordpress') # before chdir, in case sys.path is relative
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno()) # git chatter to stderr
+        os.chdir(path)
+        start = time.time()
+        if phase == 'setup':
+            paths = make_corpus(path, options.scale * 20, options.scale * 5)
+            tb = core.TrackingBranch('bench', core.GitRepo(path),
+                                     autoCreate=True, remoteType='wordpress',
+                                     repoArgs=repoArgs)
+            tb.add_paths(paths)
+            tb.commit('add benchmark corpus')
+        else:
+            tb = core.TrackingBranch('bench', core.GitRepo(path))
+            if phase == 'merge':
+                tb.merge('master')
+            elif phase == 'push':
+                tb.push(updateOnly=True, maxWorkers=options.jobs)
+            elif phase == 'rm': # unpublish the first ndeletes docs
+                for i in range(ndeletes):
+                    tb.rm(os.path.join(path, 'docs', 'doc%d.rst' % i))
+                tb.commit('unpublish benchmark docs')
+            else:
+                tb.fetch(options.jobs)
+    except Exception, e: # don't leave our parent waiting for results
+        q.put(dict(error='%s: %s' % (e.__class__.__name__, e)))
+        raise
+    q.put(dict(seconds=time.time() - start,
+               maxrss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               phase_seconds=dict([(k, v[0]) for k, v
+                                   in core.phaseTimes.items()])))
+
+def run_phase(path, phase, repoArgs, options):
+    'run _run_phase() in its own process, as a gitpub.py run would be'
+    q = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_run_phase,
+                                args=(path, phase, repoArgs, options, q))
+    p.start()
+    d = q.get()
+    p.join()
+    if 'error' in d:
+        raise ValueError('benchmark %s phase failed: %s' % (phase, d['error']))
+    return d
+
+def bench_endtoend(options):
+    '''time merge, push and fetch of a synthetic corpus (scale * 20 docs,
+    scale * 5 images) against a stand-in WordPress server, each phase
+    in its own process, as separate gitpub.py runs would be'''
+    from gitpublish import wpserver
+    server = wpserver.start_server(latency=options.latency,
+                                   bandwidth=options.bandwidth)
+    repoArgs = dict(host=server.hostname, user='bench', password='bench',
+                    appkey='bench')
+    path = tempfile.mkdtemp(prefix='gitpub-bench-')
+    ndocs = options.scale * 20
+    results = dict(docs=ndocs, images=options.scale * 5, jobs=options.jobs)
+    try:
+        for phase, ndone in (('setup', None), ('merge', ndocs + options.scale * 5),
+                             ('push', ndocs + options.scale * 5),
+                             ('fetch', ndocs)):
+            requests = server.requests
+            calls = server.store.total_calls()
+            d = run_phase(path, phase, repoArgs, options)
+            if ndone is None:
+                continue
+            d['requests'] = server.requests - requests
+            d['calls'] = server.store.total_calls() - calls
+            d['docs_per_sec'] = ndone / d['seconds']
+            d['requests_per_sec'] = d['requests'] / d['seconds']
+            results[phase] = d
+    finally:
+        server.shutdown()
+        shutil.rmtree(path)
+    results['published'] = len(server.store.docs) + len(server.store.files)
+    return results
+
+def _run_git_changes(path, repoArgs, q):
+    '''child process for bench_git_changes: push a corpus, then merge
+    with --git-changes after no edit, a committed edit and an uncommitted
+    edit, reporting which files each merge read, and which files each
+    push sent and read'''
+    try:
+        from gitpublish import core
+        core.import_plugin('wordpress') # before chdir, in case sys.path is relative
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno()) # git chatter to stderr
+        os.chdir(path)
+        paths = make_corpus(path, 6, 0)
+        tb = core.TrackingBranch('bench', core.GitRepo(path),
+                                 autoCreate=True, remoteType='wordpress',
+                                 repoArgs=repoArgs)
+        tb.add_paths(paths)
+        tb.commit('add benchmark corpus')
+        tb.push(gitChanges=True) # records each doc's blob ID
+        reads, sent = [], []
+        docInit, pushDocs = core.Document.__init__, core.Remote.push_docs
+        def read_doc(self, basepath=None, gitpubPath=None, *args, **kwargs):
+            reads.append(gitpubPath)
+            docInit(self, basepath, gitpubPath, *args, **kwargs)
+        def push_docs(self, newDocs, changedDocs, *args, **kwargs):
+            sent.extend(newDocs + changedDocs)
+            pushDocs(self, newDocs, changedDocs, *args, **kwargs)
+        core.Remote.push_docs = push_docs
+        def edit(gitpubPath):
+            ofile = open(os.path.join(path, gitpubPath), 'a')
+            try:
+                ofile.write('\nAn edit.\n')
+            finally:
+                ofile.close()
+        results = {}
+        for name, gitpubPath, commit in (('unchanged', None, False),
+                                         ('committed', 'docs/doc1.rst', True),
+                                         ('uncommitted', 'docs/doc2.rst',
+                                          False)):
+            if commit: # edit on master, for push to merge
+                tb.localRepo.checkout('master')
+                edit(gitpubPath)
+                subprocess.check_call(('git', 'commit', '-q', '-a', '-m',
+                                       'edit ' + gitpubPath))
+            elif gitpubPath:
+                edit(gitpubPath)
+            del reads[:], sent[:]
+            core.Document.__init__ = read_doc
+            try:
+                tb.merge(gitChanges=True, updateOnly=not commit)
+                mergeReads = sorted(reads)
+                del reads[:]
+                if gitpubPath: # else nothing to push, or to commit after it
+                    tb.push(updateOnly=True, gitChanges=True)
+            finally:
+                core.Document.__init__ = docInit
+            results[name] = dict(read=mergeReads, sent=sorted(sent),
+                                 pushRead=sorted(reads))
+    except Exception, e: # don't leave our parent waiting for results
+        q.put(dict(error='%s: %s' % (e.__class__.__name__, e)))
+        raise
+    q.put(results)
+
+def bench_git_changes(options):
+    '''regression check of --git-changes: ok is False unless a merge
+    reads no file when nothing changed or an edit was committed, reads
+    only the edited file when it was not committed, and push sends
+    exactly the edited docs, reading each one only once'''
+    from gitpublish import wpserver
+    server = wpserver.start_server()
+    repoArgs = dict(host=server.hostname, user='bench', password='bench',
+                    appkey='bench')
+    path = tempfile.mkdtemp(prefix='gitpub-gitchanges-')
+    try:
+        q = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_run_git_changes,
+                                    args=(path, repoArgs, q))
+        p.start()
+        results = q.get()
+        p.join()
+    finally:
+        server.shutdown()
+        shutil.rmtree(path)
+    if 'error' in results:
+        raise ValueError('git_changes check failed: %s' % results['error'])
+    results['ok'] = results['unchanged'] == dict(read=[], sent=[],
+                                                 pushRead=[]) \
+        and results['committed'] == dict(read=[], sent=['docs/doc1.rst'],
+                                         pushRead=['docs/doc1.rst']) \
+        and results['uncommitted'] == dict(read=['docs/doc2.rst'],
+                                           sent=['docs/doc2.rst'],
+                                           pushRead=['docs/doc2.rst'])
+    return results
+
+ndeletes = 2 # docs that the rm phase unpublishes
+
+def bench_deletes(options):
+    '''regression check: deletes that fault within a multicall batch
+    must stay pending, so that the next push deletes them, even if a
+    fetch in another process commits in between.  ok is False unless
+    the faulted push deleted nothing, the fetch imports none of the
+    pending docs back, and the clean push that follows deletes all
+    ndeletes docs'''
+    from gitpublish import wpserver
+    server = wpserver.start_server()
+    repoArgs = dict(host=server.hostname, user='bench', password='bench',
+                    appkey='bench', batchSize=4)
+    options = optparse.Values(dict(scale=1, jobs=options.jobs))
+    path = tempfile.mkdtemp(prefix='gitpub-deletes-')
+    results = {}
+    try:
+        for phase in ('setup', 'push', 'rm'):
+            run_phase(path, phase, repoArgs, options)
+        results['published'] = len(server.store.docs)
+        server.faultRate = 1.
+        run_phase(path, 'push', repoArgs, options)
+        results['after_faulted_push'] = len(server.store.docs)
+        results['faults'] = server.faults
+        server.faultRate = 0.
+        d = server.store.docs[max(server.store.docs, key=int)]
+        server.store._edit(d['post_type'], d['post_id'], d['title'],
+                           d['description'] + '<p>A remote edit.</p>')
+        run_phase(path, 'fetch', repoArgs, options) # commits a new lastpush
+        results['fetched'] = sorted(os.listdir(os.path.join(path,
+                                                            'bench-import')))
+        run_phase(path, 'push', repoArgs, options)
+        results['after_clean_push'] = len(server.store.docs)
+    finally:
+        server.shutdown()
+        shutil.rmtree(path)
+    results['ok'] = results['after_faulted_push'] == results['published'] \
+        and results['fetched'] == [] \
+        and results['after_clean_push'] == results['published'] - ndeletes
+    return results
+
+feedPageSize = 5 # so the blogger_feed check follows several next links
+
+def bench_blogger_feed(options):
+    '''regression check of the blogger plugin's paged listing, against a
+    stand-in feed server.  ok is False unless listing everything reads
+    listPageSize entries per request and follows next links to the end,
+    listing up to maxposts stops requesting once it has them, looking
+    up every doc from several threads at once lists each feed only
+    once, and lookups after a full listing make no requests at all.
+    Skipped if the plugin can't load, e.g. gdata is not installed'''
+    from gitpublish import core, feedserver
+    try:
+        Repo = core.import_plugin('blogger')
+    except ImportError, e:
+        return dict(skipped=str(e))
+    server = feedserver.start_server()
+    nposts, npages = 25 * options.scale + 3, 3 * options.scale
+    server.add_entries('posts', nposts)
+    server.add_entries('pages', npages)
+    def get_repo():
+        repo = Repo(None, 'bench', 'bench', blog_id=server.blogID,
+                    feedHost=server.hostname, listPageSize=feedPageSize)
+        repo.logged_in = True # no ClientLogin against the stand-in
+        return repo
+    def feed_requests(feedType, total, pageSize, n=None):
+        'requests that listing n (default: all) entries should make'
+        if n is None:
+            n = total
+        return [(feedType, i + 1, pageSize,
+                 min(pageSize, total - i)) # entries served
+                for i in range(0, n, pageSize)] # one per page
+    repo = get_repo()
+    results = dict(posts=nposts, pages=npages)
+    try:
+        for name, maxposts in (('all', None), ('maxposts', nposts // 2)):
+            del server.requests[:]
+            start = time.time()
+            ids = [k for k, d in repo.iter_documents(maxposts)]
+            d = dict(seconds=time.time() - start, docs=len(ids),
+                     requests=len(server.requests))
+            ok = len(set(ids)) == len(ids)
+            pageSize = repo.listPageSize
+            if maxposts is not None:
+                pageSize = min(pageSize, maxposts)
+            for feedType, total in (('posts', nposts), ('pages', npages)):
+                n = total # entries we should list
+                if maxposts is not None:
+                    n = min(n, maxposts)
+                ok = ok and [t for t in server.requests if t[0] == feedType] \
+                     == feed_requests(feedType, total, pageSize, n)
+                d[feedType] = n
+            d['ok'] = ok and len(ids) == d['posts'] + d['pages']
+            results[name] = d
+        ids = [k for k, d in repo.iter_documents()] # full listing, then
+        for name, lookupRepo in (('lookups', get_repo()), # a fresh session
+                                 ('lookups_after_listing', repo)):
+            del server.requests[:]
+            start = time.time()
+            titles = core.map_threaded(
+                lambda gitpubID: lookupRepo.get_html_document(gitpubID)[1]
+                ['title'], ids, 8)
+            d = dict(seconds=time.time() - start, docs=len(titles),
+                     requests=len(server.requests))
+            expected = []
+            if lookupRepo is not repo: # must list each feed just once
+                expected = feed_requests('posts', nposts, repo.listPageSize) \
+                           + feed_requests('pages', npages, repo.listPageSize)
+            d['ok'] = sorted(server.requests) == sorted(expected) \
+                      and len(set(titles)) == nposts + npages
+            results[name] = d
+    finally:
+        server.shutdown()
+    results['ok'] = results['all']['ok'] and results['maxposts']['ok'] \
+        and results['lookups']['ok'] and results['lookups_after_listing']['ok']
+    return results
+
+# modules that gitpub.py commands which don't render or talk to the
+# remote should never import
+heavyModules = ('docutils', 'xmlrpclib', 'multiprocessing', 'sgmllib',
+                'gitpublish.plugin.wordpress', 'gitpublish.plugin.blogger',
+                'gitpublish.plugin.translator.html2rest',
+                'gitpublish.plugin.translator.rst2wp', 'gdata', 'sphinx')
+
+startupScript = '''import imp, json, sys
+gitpub = imp.load_source('gitpub', %r)
+gp = gitpub.Interface()
+gp.remote_list()
+gp.get_tracking_branch('bench').get_stage()
+print json.dumps([k for k, v in sys.modules.items() if v is not None])
+'''
+
+def bench_startup(options):
+    '''startup regression check: time gitpub.py commands that neither
+    render nor talk to the remote, and list any heavyModules they import.
+    ok is False if they import any, or take over options.maxStartup
+    seconds longer than starting python itself'''
+    path = tempfile.mkdtemp(prefix='gitpub-startup-')
+    gitpub = os.path.join(srcDir, 'gitpub.py')
+    env = dict(os.environ, PYTHONPATH=srcDir)
+    devnull = open(os.devnull, 'w')
+    def run(*args):
+        subprocess.check_call((sys.executable,) + args, cwd=path, env=env,
+                              stdout=devnull, stderr=devnull)
+    try:
+        make_corpus(path, 1, 0)
+        run(gitpub, 'remote', 'add', 'bench', 'wordpress:bench@localhost')
+        results = dict(python_seconds=best_time(lambda: run('-c', 'pass'),
+                                                options.repeat)[0])
+        for name, args in (('remote', ('remote',)),
+                           ('add', ('add', 'docs/doc0.rst'))):
+            results[name + '_seconds'] = best_time(lambda: run(gitpub, *args),
+                                                   options.repeat)[0]
+        p = subprocess.Popen((sys.executable, '-c', startupScript % gitpub),
+                             cwd=path, env=env, stdout=subprocess.PIPE,
+                             stderr=devnull)
+        modules = set(json.loads(p.communicate()[0]))
+    finally:
+        devnull.close()
+        shutil.rmtree(path)
+    results['heavy_modules'] = [m for m in heavyModules if m in modules]
+    results['ok'] = not results['heavy_modules'] and \
+        max(results['remote_seconds'], results['add_seconds']) \
+        - results['python_seconds'] <= options.maxStartup
+    return results
+
+benchmarks = dict(html2rest=bench_html2rest, nested_lists=bench_nested_lists,
+                  moin=bench_moin, endtoend=bench_endtoend,
+                  deletes=bench_deletes, git_changes=bench_git_changes,
+                  blogger_feed=bench_blogger_feed, startup=bench_startup)
+
+def get_options():
+    parser = optparse.OptionParser(usage='%prog [options] [benchmark ...]')
+    parser.add_option(
+        '-r', '--repeat', action='store', type='int', dest='repeat', default=3,
+        help='report the best of this many runs')
+    parser.add_option(
+        '-s', '--scale', action='store', type='int', dest='scale', default=10,
+        help='number of copies of the test corpus to process')
+    parser.add_option(
+        '--rst', action='append', dest='paths', default=[],
+        help='.rst file to use as test corpus (default: doc/*.rst)')
+    parser.add_option(
+        '--moin-dir', action='store', dest='moinDir',
+        help='directory of Moin pages that moin checks convert unchanged')
+    parser.add_option(
+        '-j', '--jobs', action='store', type='int', dest='jobs', default=1,
+        help='concurrent requests for endtoend push and fetch')
+    parser.add_option(
+        '--latency', action='store', type='float', dest='latency', default=0.,
+        help='seconds the endtoend stand-in server adds to each request')
+    parser.add_option(
+        '--bandwidth', action='store', type='int', dest='bandwidth',
+        help='bytes/sec cap on each endtoend stand-in server request')
+    parser.add_option(
+        '--max-startup', action='store', type='float', dest='maxStartup',
+        default=0.25,
+        help='seconds gitpub.py startup may add to python\'s own, for startup')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    options, args = get_options()
+    results = {}
+    for name in args or sorted(benchmarks):
+        results[name] = benchmarks[name](options)
+    json.dump(results, sys.stdout, sort_keys=True, indent=4)
+    print
+    if [r for r in results.values() # a regression check failed
+        if isinstance(r, dict) and r.get('ok') is False]:
+        sys.exit(1)
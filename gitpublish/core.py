@@ -1,13 +1,27 @@
-from docutils.core import publish_string
-from xml.etree.ElementTree import XML, Element, SubElement, ElementTree
 import os
+import re
 import hashlib
 from subprocess import Popen, PIPE
 import codecs
 import sys
 import json
+import threading
+import Queue
+import time
+import tempfile
+import shutil
+from StringIO import StringIO
 from getpass import getpass
+# docutils, html2rest, multiprocessing, xmlrpclib and the remote's plugin
+# are imported only where we render, convert or talk to the remote,
+# so that commands like gitpub.py add / commit start fast
 
+renderSettings = dict(report_level=5) # docutils settings for parse & render
+emptyTreeID = '4b825dc642cb6eb9a060e54bf8d69288fbee4904' # built into git
+nullBlobID = '0' * 40 # git diff's blob ID for content it hasn't hashed
+# image and figure directives, including |substitution| image definitions
+imageRefRE = re.compile(r'^[ \t]*\.\.[ \t]+(?:\|[^|]+\|[ \t]+)?(?:image|figure)::'
+                        r'[ \t]*(\S+)', re.MULTILINE)
 
 def _read(ifile):
     try:
@@ -15,6 +29,66 @@ def _read(ifile):
     finally:
         ifile.close()
 
+# wall time and number of calls of each phase timed by PhaseTimer,
+# as phase name: [seconds, calls], summed over all threads
+phaseTimes = {}
+_phaseLock = threading.Lock()
+_phaseLocal = threading.local() # phases being timed in this thread
+
+class PhaseTimer(object):
+    '''context manager or function decorator adding the wall time spent
+    in it to phaseTimes[phase].  Nested timers for the same phase in
+    one thread only count once, e.g. Document.render() calling
+    get_doctree().  Costs two time.time() calls, so always on'''
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        try:
+            active = _phaseLocal.active
+        except AttributeError:
+            active = _phaseLocal.active = {}
+        try:
+            active[self.phase][1] += 1 # already timing this phase
+        except KeyError:
+            active[self.phase] = [time.time(), 1]
+        return self
+
+    def __exit__(self, *exc_info):
+        t = _phaseLocal.active[self.phase]
+        t[1] -= 1
+        if not t[1]: # outermost timer for this phase
+            del _phaseLocal.active[self.phase]
+            add_phase_time(self.phase, time.time() - t[0])
+        return False
+
+    def __call__(self, func):
+        def timed_func(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        timed_func.__name__ = func.__name__
+        timed_func.__doc__ = func.__doc__
+        return timed_func
+
+def add_phase_time(phase, seconds, calls=1):
+    'add seconds (and calls) to phaseTimes[phase]'
+    with _phaseLock:
+        t = phaseTimes.setdefault(phase, [0., 0])
+        t[0] += seconds
+        t[1] += calls
+
+def format_phase_times(total=None):
+    '''phaseTimes as a text table, slowest phase first.  Phases run in
+    several threads at once can add up to more than the total wall time'''
+    lines = ['%-10s %10s %8s' % ('phase', 'seconds', 'calls')]
+    with _phaseLock:
+        items = sorted(phaseTimes.items(), key=lambda t: -t[1][0])
+    for phase, (seconds, calls) in items:
+        lines.append('%-10s %10.3f %8d' % (phase, seconds, calls))
+    if total is not None:
+        lines.append('%-10s %10.3f' % ('total', total))
+    return '\n'.join(lines)
+
 class Document(object):
     def __init__(self, basepath=None, gitpubPath=None, rest=None, binaryData=None,
                  docmap=None, title=None):
@@ -40,14 +114,46 @@ class Document(object):
 
     def open_rest(self):
         self.rest = _read(codecs.open(self.path, 'r', 'utf-8'))
-        xhtml = publish_string(self.rest, writer_name='xml',
-                               settings_overrides=dict(report_level=5))
-        x = XML(xhtml) # parse the XML text
-        t = x.find('title')
+
+    @PhaseTimer('render')
+    def get_doctree(self):
+        'parse our ReST with docutils (only once), and return the doctree'
         try:
-            self.title = t.text #extract its title
+            return self._doctree
         except AttributeError:
-            self.title = 'Untitled'
+            from docutils.core import publish_doctree
+            self._doctree = publish_doctree(self.rest,
+                                            settings_overrides=renderSettings)
+            return self._doctree
+
+    def _get_title(self):
+        'title given by caller, or else extracted from our doctree'
+        try:
+            return self._title
+        except AttributeError:
+            pass
+        if not hasattr(self, 'rest'):
+            raise AttributeError('binary document has no title')
+        from docutils import nodes
+        self._title = 'Untitled'
+        for node in self.get_doctree().children:
+            if isinstance(node, nodes.title): # doctitle_xform put it here
+                self._title = node.astext() #extract its title
+                break
+        return self._title
+
+    def _set_title(self, title):
+        self._title = title
+
+    title = property(_get_title, _set_title)
+
+    @PhaseTimer('render')
+    def render(self, writer):
+        'render our doctree to a string, using the specified docutils writer'
+        from docutils.core import publish_from_doctree
+        doctree = self.get_doctree().deepcopy() # writers may alter the tree
+        return publish_from_doctree(doctree, writer=writer,
+                                    settings_overrides=renderSettings)
 
     def set_content_type(self, contentType=None, filename=None):
         'guess from filename if not provided by caller'
@@ -59,11 +165,23 @@ class Document(object):
             filename = self.path
         self.contentType = typeDict[filename.split('.')[-1]]
 
+    def get_ref_path(self, relpath):
+        'get gitpubPath for a path relative to this doc'
+        return os.path.normpath(os.path.join(os.path.dirname(self.gitpubPath),
+                                             relpath))
+
     def relative_path(self, relpath):
         'get doc info dict for path relative to this doc, or KeyError'
-        gitpubPath = os.path.normpath(os.path.join(os.path.dirname(self.gitpubPath),
-                                                   relpath))
-        return self.docmap[gitpubPath]
+        return self.docmap[self.get_ref_path(relpath)]
+
+    def get_ref_paths(self):
+        '''get gitpubPaths of the local images this doc refers to, by scanning
+        its ReST for image / figure directives (without parsing it)'''
+        l = []
+        for uri in imageRefRE.findall(getattr(self, 'rest', '')):
+            if '://' not in uri: # skip images not stored locally
+                l.append(self.get_ref_path(uri))
+        return l
 
     def open_image(self):
         self.binaryData = _read(file(self.path))
@@ -82,6 +200,13 @@ class Document(object):
         finally:
             ifile.close()
 
+    def get_data(self):
+        'get file contents as bytes, exactly as write() would save them'
+        try:
+            return codecs.getencoder('utf8')(self.rest)[0]
+        except AttributeError:
+            return self.binaryData
+
     def write(self):
         if hasattr(self, 'rest'):
             self.write_rest()
@@ -115,6 +240,64 @@ def copy_kwargs(kwargs):
         d[str(k)] = v
     return d
 
+def map_threaded(func, items, maxWorkers=1):
+    '''call func(item) for each item using up to maxWorkers threads,
+    returning list of results in the same order as items.  If any call
+    raises an exception, the first one is re-raised after all workers exit'''
+    items = list(items)
+    if maxWorkers <= 1 or len(items) <= 1: # no need for threads
+        return [func(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+    q = Queue.Queue()
+    for i, item in enumerate(items):
+        q.put((i, item))
+    def worker():
+        while not errors: # stop taking new work after an error
+            try:
+                i, item = q.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = func(item)
+            except Exception:
+                errors.append(sys.exc_info())
+    threads = [threading.Thread(target=worker)
+               for i in range(min(maxWorkers, len(items)))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+@PhaseTimer('html2rest')
+def html_to_rest(html):
+    'convert HTML to ReST text'
+    from plugin.translator import html2rest
+    buf = StringIO()
+    parser = html2rest.StreamParser(buf)
+    parser.feed(html)
+    parser.close()
+    return buf.getvalue()
+
+def try_html_to_rest(html):
+    '''(html_to_rest(), seconds it took), with None as the ReST if
+    conversion fails.  Top-level function so that multiprocessing can
+    send it to its worker processes'''
+    start = time.time()
+    try:
+        rest = html_to_rest(html)
+    except StandardError:
+        rest = None
+    return rest, time.time() - start
+
+def split_batches(items, batchSize):
+    'split list of items into lists of up to batchSize items'
+    return [items[i:i + batchSize] for i in range(0, len(items), batchSize)]
+
 def save_json(path, d):
     'save Python data to JSON file'
     ifile = open(path, 'w')
@@ -124,11 +307,49 @@ def save_json(path, d):
     finally:
         ifile.close()
 
+class StatIndex(object):
+    '''Records (size, mtime_ns, inode) of each file and the gitpubHash
+    computed from it, so DocMap.update() only needs to re-read and rehash
+    files whose stat changed.  Stat info is machine-specific, so this
+    is saved under .gitpub/local rather than committed.'''
+    def __init__(self, path):
+        self.path = path
+        try:
+            ifile = open(path)
+        except IOError:
+            self.dict = {}
+        else:
+            try:
+                self.dict = json.load(ifile)
+            except ValueError: # corrupt index, just rebuild it
+                self.dict = {}
+            finally:
+                ifile.close()
+
+    def get_stat(self, path):
+        'get [size, mtime_ns, inode] list for this file'
+        st = os.stat(path)
+        return [st.st_size, int(st.st_mtime * 1000000000), st.st_ino]
+
+    def get_hash(self, gitpubPath, stat):
+        'get gitpubHash recorded for this file, or None if its stat changed'
+        try:
+            indexStat, gitpubHash = self.dict[gitpubPath]
+        except KeyError:
+            return None
+        if indexStat == stat:
+            return gitpubHash
+
+    def save(self):
+        save_json(self.path, self.dict)
+
+
 class DocMap(object):
     def __init__(self):
         self.revDict = {} # map from remote docID to attribute dictionary
         self.dict = {} # map from gitpubPath to attribute dictionary
 
+    @PhaseTimer('docmap')
     def init_from_file(self, path):
         'initialize mapping from saved json file'
         ifile = open(path)
@@ -142,6 +363,7 @@ class DocMap(object):
             ifile.close()
         return remoteType, copy_kwargs(repoArgs)
 
+    @PhaseTimer('docmap')
     def save_file(self, path, remoteType, repoArgs):
         'save dict and revDict to our json file'
         d = dict(remoteType=remoteType, repoArgs=repoArgs, docDict=self.dict,
@@ -199,24 +421,57 @@ class DocMap(object):
     def delete_remote_mapping(self, gitpubID):
         'delete mapping associated with a remote doc ID'
         try:
-            del self.dict[self.revDict[gitpubID]['gitpubPath']]
+            gitpubPath = self.revDict.pop(gitpubID)['gitpubPath']
+        except KeyError: # already unmapped, e.g. by TrackingBranch.rm()
+            return
+        try:
+            del self.dict[gitpubPath]
         except KeyError:
             pass
-        del self.revDict[gitpubID]
 
     def __sub__(self, oldmap):
         'get analysis of doc differences vs. oldmap'
         return DocMapDiff(self, oldmap)
 
-    def update(self, basepath):
-        'update all gitpubHash values based on current file contents'
+    def update(self, basepath, index=None, rehash=False, blobs=None):
+        '''update all gitpubHash values based on current file contents.
+        If a StatIndex is given, only files whose stat changed are
+        re-read, unless rehash is True.  If blobs maps gitpubPath to git
+        blob ID, files whose blob matches their recorded gitpubBlob are
+        skipped, and files whose blob changed get it as their gitpubHash,
+        without reading either (push rehashes the files it sends)'''
         docChanged = False
         for gitpubPath,d in self.dict.items():
-            doc = Document(basepath, gitpubPath)
-            gitpubHash = doc.get_hash()
+            blobID = None
+            if blobs is not None:
+                blobID = blobs.get(gitpubPath)
+            if blobID and d.get('gitpubBlob') and 'gitpubHash' in d:
+                if blobID != d['gitpubBlob']: # changed, so will be pushed
+                    d['gitpubBlob'] = d['gitpubHash'] = blobID
+                    docChanged = True
+                continue
+            gitpubHash = None
+            if index is not None:
+                stat = index.get_stat(os.path.join(basepath, gitpubPath))
+                if not rehash:
+                    gitpubHash = index.get_hash(gitpubPath, stat)
+            if gitpubHash is None: # have to read the file
+                doc = Document(basepath, gitpubPath)
+                gitpubHash = doc.get_hash()
+                if index is not None:
+                    index.dict[gitpubPath] = [stat, gitpubHash]
             if gitpubHash != d.get('gitpubHash', ''):
                 d['gitpubHash'] = gitpubHash
+                d.pop('gitpubBlob', None) # recorded for its old content
                 docChanged = True
+            if blobID and blobID != d.get('gitpubBlob'): # file matches blob
+                d['gitpubBlob'] = blobID
+                docChanged = True
+        if index is not None:
+            for gitpubPath in index.dict.keys(): # drop unmapped files
+                if gitpubPath not in self.dict:
+                    del index.dict[gitpubPath]
+            index.save()
         return docChanged # report whether any doc got updated
 
 class DocMapDiff(object):
@@ -263,23 +518,237 @@ class DocMapDiff(object):
         self.changedDocs = changedDocs
 
 
+def get_local_dir(basepath, *subdirs):
+    '''get (and create if needed) a directory under .gitpub/local, for
+    machine-specific files that should never be committed'''
+    localDir = os.path.join(basepath, '.gitpub', 'local')
+    if not os.path.isdir(localDir):
+        os.makedirs(localDir)
+        ifile = open(os.path.join(localDir, '.gitignore'), 'w')
+        try:
+            print >>ifile, '*' # keep git from ever adding these files
+        finally:
+            ifile.close()
+    path = os.path.join(localDir, *subdirs)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+class EventLog(object):
+    '''appends events (dicts) to a JSON-lines file, one line per event,
+    stamped with its time.  Safe to share between threads'''
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, d):
+        line = json.dumps(dict(d, time=time.time()), sort_keys=True)
+        with self._lock:
+            ifile = open(self.path, 'a')
+            try:
+                print >>ifile, line
+            finally:
+                ifile.close()
+
+
+class DocEvent(object):
+    '''times a document operation (event) from its creation, or from
+    __enter__, and writes it to eventLog (unless that is None) with its
+    seconds and the bytes repo's transport sent and received in this
+    thread meanwhile.  As a context manager it writes one event on exit,
+    including any error.  For a batch request, call write(n=len(batch))
+    for each of its docs: each gets the batch's time, and 1/n of its bytes'''
+    def __init__(self, eventLog, event, repo=None, **fields):
+        self.eventLog = eventLog
+        self.fields = dict(event=event, **fields)
+        self.transport = getattr(repo, 'transport', None)
+        self.restart()
+
+    def restart(self):
+        if self.eventLog is not None:
+            self.start = time.time()
+            self.startBytes = self.get_bytes()
+
+    def get_bytes(self):
+        '(sent, received) by this thread, or None if transport does not count'
+        try:
+            return self.transport.get_bytes()
+        except AttributeError:
+            return None
+
+    def write(self, n=1, error=None, **fields):
+        if self.eventLog is None:
+            return
+        d = dict(self.fields, seconds=time.time() - self.start)
+        if self.startBytes is not None:
+            sent, received = self.get_bytes()
+            d['bytes_sent'] = (sent - self.startBytes[0]) / n
+            d['bytes_received'] = (received - self.startBytes[1]) / n
+        if n > 1:
+            d['batch'] = n
+        if error is not None:
+            d['error'] = str(error)
+        d.update(fields)
+        self.eventLog.write(d)
+
+    def __enter__(self):
+        self.restart()
+        return self
+
+    def __exit__(self, excType, e, tb):
+        if excType is None:
+            self.write()
+        else:
+            self.write(error='%s: %s' % (excType.__name__, e))
+        return False
+
+
+class HashingWriter(object):
+    '''file-like object that saves text (utf-8 encoded) to path in chunks
+    of bufSize bytes, computing their sha1 hash (the same as
+    Document.get_hash()) as it goes'''
+    def __init__(self, path, bufSize=65536):
+        self.ofile = open(path, 'wb')
+        self.bufSize = bufSize
+        self.sha1 = hashlib.sha1()
+        self.buf = []
+        self.nbuf = 0
+        self.size = 0 # bytes written so far
+        self.softspace = 0 # for print >>
+
+    def write(self, s):
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        self.buf.append(s)
+        self.nbuf += len(s)
+        if self.nbuf >= self.bufSize:
+            self.flush()
+
+    def flush(self):
+        data = ''.join(self.buf)
+        self.buf = []
+        self.nbuf = 0
+        self.sha1.update(data)
+        self.ofile.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self.flush()
+        self.ofile.close()
+
+    def hexdigest(self):
+        return self.sha1.hexdigest()
+
+
+class RenderCache(object):
+    '''On-disk cache of rendered HTML, keyed by gitpubHash, translator class,
+    docutils version and render settings.  Each entry also records the
+    remote path each image ref resolved to, so that an entry is only used
+    if those refs still resolve the same way.  Least recently used
+    entries are evicted when the cache grows beyond maxBytes.'''
+    def __init__(self, path, maxBytes=50000000):
+        self.path = path
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+        self._sizes = None # cache file sizes, read on first put()
+
+    def get_key(self, gitpubHash, translator):
+        'get cache key for rendering this content with this translator class'
+        import docutils
+        k = json.dumps([gitpubHash, translator.__module__ + '.' +
+                        translator.__name__, docutils.__version__,
+                        sorted(renderSettings.items())])
+        return hashlib.sha1(k).hexdigest()
+
+    def get(self, key):
+        'return cached entry dict, or None'
+        path = os.path.join(self.path, key + '.json')
+        try:
+            ifile = open(path)
+        except IOError:
+            return None
+        try:
+            entry = json.load(ifile)
+        except ValueError: # truncated or corrupt entry
+            return None
+        finally:
+            ifile.close()
+        try:
+            os.utime(path, None) # mark as recently used
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        'save entry dict, then evict old entries if cache is too big'
+        path = os.path.join(self.path, key + '.json')
+        tmppath = '%s.%d.tmp' % (path, threading.current_thread().ident)
+        save_json(tmppath, entry)
+        os.rename(tmppath, path) # never expose a partly written entry
+        with self._lock:
+            if self._sizes is None:
+                self._sizes = {}
+                for filename in os.listdir(self.path):
+                    if filename.endswith('.json'):
+                        self._sizes[filename] = os.path.getsize(
+                            os.path.join(self.path, filename))
+            self._sizes[key + '.json'] = os.path.getsize(path)
+            if sum(self._sizes.values()) > self.maxBytes:
+                self.evict()
+
+    def evict(self):
+        'delete least recently used entries until we are under maxBytes'
+        l = []
+        for filename in self._sizes:
+            try:
+                l.append((os.path.getmtime(os.path.join(self.path, filename)),
+                          filename))
+            except OSError: # already gone
+                l.append((0, filename))
+        l.sort()
+        total = sum(self._sizes.values())
+        for mtime, filename in l:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except OSError:
+                pass
+            total -= self._sizes.pop(filename)
+
+
 class Remote(object):
     def __init__(self, name, basepath, remoteType=None, repoArgs=None,
-                 importDir='%s-import'):
+                 importDir='%s-import', maxWorkers=1):
         self.name = name
         self.basepath = basepath
         self.importDir = importDir
+        self.maxWorkers = maxWorkers # max concurrent requests to this remote
+        self._docmapLock = threading.Lock()
+        self.pushDocs = {} # gitpubPath to Document read by get_push_order()
         self.path = os.path.join(basepath, '.gitpub', name + '.json')
         if not os.path.isdir(os.path.join(basepath, '.gitpub')): # create dir if needed
             os.mkdir(os.path.join(basepath, '.gitpub'))
+        self.failedDeletesPath = os.path.join(get_local_dir(basepath),
+                                              name + '.faileddeletes.json')
+        try: # gitpubID to docDict of deletes to retry, saved by last push
+            ifile = open(self.failedDeletesPath)
+        except IOError:
+            self.failedDeletes = {}
+        else:
+            try:
+                self.failedDeletes = json.load(ifile)
+            finally:
+                ifile.close()
         self.docmap = DocMap()
         try:
             remoteType, repoArgs = self.docmap.init_from_file(self.path)
             newRemote = False
         except IOError:
             newRemote = True
-        klass = import_plugin(remoteType)
-        self.repo = klass(**repoArgs)
+        self.eventLog = EventLog(os.path.join(get_local_dir(basepath),
+                                              name + '.events.jsonl'))
         self.remoteType = remoteType
         self.repoArgs = repoArgs
         ## if newRemote:
@@ -290,16 +759,50 @@ class Remote(object):
         ##         self.docmap.init_from_repo(self.path, remoteType, repoArgs,
         ##                                    docDict)
 
+    def _get_repo(self):
+        'import our plugin and create its Repo, only when first needed'
+        try:
+            return self._repo
+        except AttributeError:
+            pass
+        klass = import_plugin(self.remoteType)
+        repo = klass(**self.repoArgs)
+        repo.renderCache = RenderCache(get_local_dir(self.basepath, 'render'))
+        repo.eventLog = self.eventLog
+        self._repo = repo
+        return repo
+
+    repo = property(_get_repo)
+
+    def get_stat_index(self):
+        'get StatIndex of the files mapped by this remote'
+        return StatIndex(os.path.join(get_local_dir(self.basepath),
+                                      self.name + '.index.json'))
+
+    def save_failed_deletes(self):
+        '''save failedDeletes under .gitpub/local, so that any later commit
+        of lastpush.json keeps them, even from another process'''
+        if self.failedDeletes:
+            save_json(self.failedDeletesPath, self.failedDeletes)
+        elif os.path.exists(self.failedDeletesPath):
+            os.remove(self.failedDeletesPath)
+
     def save_doc_map(self, lastPush=False):
+        docmap = self.docmap
         if lastPush:
             path = os.path.join(self.basepath, '.gitpub',
                                 self.name + '.lastpush.json')
+            if self.failedDeletes: # keep them, so next push deletes them again
+                docmap = docmap.copy()
+                docmap.revDict.update(self.failedDeletes)
         else:
             path = self.path
-        self.docmap.save_file(path, self.remoteType, self.repoArgs)
+        docmap.save_file(path, self.remoteType, self.repoArgs)
         return path
                 
-    def push(self, newmap=None):
+    def push(self, newmap=None, maxWorkers=None):
+        '''send new, changed and deleted docs to the remote, using up to
+        maxWorkers concurrent requests (default: self.maxWorkers)'''
         if newmap is None: # send changes since last push, based on saved docmap
             oldmap = DocMap()
             oldmap.init_from_file(os.path.join(self.basepath, '.gitpub',
@@ -308,44 +811,244 @@ class Remote(object):
             diff = self.docmap - oldmap
         else:
             diff = newmap - self.docmap # analyze doc map changes
+        if maxWorkers is None:
+            maxWorkers = self.maxWorkers
+        if maxWorkers > 1 and hasattr(self.repo, 'check_password'):
+            self.repo.check_password() # prompt once, not from every thread
+            if hasattr(self.repo, 'appkey') and \
+                   [gitpubID for gitpubID in diff.deletedDocs
+                    if gitpubID.startswith('post:')]: # deleting posts needs it
+                self.repo.check_password('appkey')
         unresolvedRefs = set()
-        for gitpubPath in diff.newDocs: # publish new docs on remote repo
+        self.pushErrors = {} # docs that failed within a multicall batch
+        self.failedDeletes = {}
+        self.pushDocs = {}
+        levels, missing = self.get_push_order(newmap, diff.newDocs
+                                              + diff.changedDocs)
+        newDocs = set(diff.newDocs)
+        for level in levels: # each level only refers to assets pushed before
+            self.push_docs([p for p in level if p in newDocs],
+                           [p for p in level if p not in newDocs],
+                           newmap, unresolvedRefs, maxWorkers)
+        self.push_deletes(diff.deletedDocs, maxWorkers)
+        for gitpubID in diff.deletedDocs:
+            if gitpubID in self.pushErrors: # still on remote
+                self.failedDeletes[gitpubID] = diff.oldmap.revDict[gitpubID]
+        self.save_failed_deletes()
+        self.pushDocs = {}
+        for doc in unresolvedRefs: # e.g. an image it shows failed to upload
+            if doc.gitpubPath in missing or doc.gitpubPath in self.pushErrors:
+                continue # already reported
+            print >>sys.stderr, '%s sent with unresolved refs, will resend' \
+                  ' on next push' % doc.gitpubPath
+            try: # so that the next push sends it again
+                del self.docmap[doc.gitpubPath]['gitpubHash']
+            except KeyError:
+                pass
+
+    def get_push_order(self, newmap, gitpubPaths):
+        '''sort docs to push into levels, such that each doc comes after
+        the assets it refers to.  Reports refs to missing targets and
+        reference cycles up front.  Keeps each Document it reads in
+        self.pushDocs for get_push_job().  Returns list of levels, and dict
+        {gitpubPath: [missing targets]}'''
+        pushing = set(gitpubPaths)
+        deps = {}
+        users = {}
+        missing = {}
+        for gitpubPath in gitpubPaths:
+            if not gitpubPath.endswith('.rst'): # assets have no refs
+                deps[gitpubPath] = set()
+                continue
+            doc = Document(self.basepath, gitpubPath, docmap=self.docmap)
+            self.pushDocs[gitpubPath] = doc
+            deps[gitpubPath] = set()
+            for target in doc.get_ref_paths():
+                if target in pushing:
+                    deps[gitpubPath].add(target)
+                    users.setdefault(target, []).append(gitpubPath)
+                elif target not in newmap.dict or \
+                     'gitpubRemotePath' not in self.docmap.dict.get(target, {}):
+                    missing.setdefault(gitpubPath, []).append(target)
+        for gitpubPath, targets in missing.items():
+            print >>sys.stderr, '%s refers to unpublished files: %s' \
+                  % (gitpubPath, ', '.join(targets))
+        levels = []
+        level = [p for p in gitpubPaths if not deps[p]]
+        done = set(level)
+        while level:
+            levels.append(level)
+            nextLevel = []
+            for target in level:
+                for gitpubPath in users.get(target, ()):
+                    deps[gitpubPath].discard(target)
+                    if not deps[gitpubPath] and gitpubPath not in done:
+                        nextLevel.append(gitpubPath)
+                        done.add(gitpubPath)
+            level = nextLevel
+        cycle = [p for p in gitpubPaths if p not in done]
+        if cycle: # push them last; their refs resolve on the next push
+            print >>sys.stderr, 'reference cycle among: %s' % ', '.join(cycle)
+            levels.append(cycle)
+        return levels, missing
+
+    def push_docs(self, newDocs, changedDocs, newmap, unresolvedRefs,
+                  maxWorkers=1):
+        'publish new docs then update changed docs on remote repo'
+        batchSize = getattr(self.repo, 'batchSize', 0)
+        if batchSize > 1: # send many docs per request via system.multicall
+            map_threaded(lambda gitpubPaths:
+                         self.push_new_batch(gitpubPaths, newmap,
+                                             unresolvedRefs),
+                         split_batches(newDocs, batchSize), maxWorkers)
+            map_threaded(lambda gitpubPaths:
+                         self.push_changed_batch(gitpubPaths, newmap,
+                                                 unresolvedRefs),
+                         split_batches(changedDocs, batchSize), maxWorkers)
+        else:
+            map_threaded(lambda gitpubPath:
+                         self.push_new(gitpubPath, newmap, unresolvedRefs),
+                         newDocs, maxWorkers)
+            map_threaded(lambda gitpubPath:
+                         self.push_changed(gitpubPath, newmap, unresolvedRefs),
+                         changedDocs, maxWorkers)
+
+    def push_deletes(self, gitpubIDs, maxWorkers=1):
+        'remove deleted docs from remote repo'
+        batchSize = getattr(self.repo, 'batchSize', 0)
+        if batchSize > 1:
+            map_threaded(self.push_delete_batch,
+                         split_batches(gitpubIDs, batchSize), maxWorkers)
+        else:
+            map_threaded(self.push_delete, gitpubIDs, maxWorkers)
+
+    def get_push_job(self, gitpubPath, newmap):
+        'get Document and docDict to send for this gitpubPath'
+        try: # already read by get_push_order()
+            newdoc = self.pushDocs.pop(gitpubPath)
+        except KeyError:
             newdoc = Document(self.basepath, gitpubPath, docmap=self.docmap)
-            docDict = copy_kwargs(newmap.dict[gitpubPath])
-            docDict['gitpubHash'] = newdoc.get_hash()
+        docDict = copy_kwargs(newmap.dict[gitpubPath])
+        docDict['gitpubHash'] = newdoc.get_hash()
+        return newdoc, docDict
+
+    def push_new(self, gitpubPath, newmap, unresolvedRefs):
+        'publish a new doc on remote repo, and add it to our docmap'
+        newdoc, docDict = self.get_push_job(gitpubPath, newmap)
+        with DocEvent(self.eventLog, 'upload', self.repo,
+                      gitpubPath=gitpubPath) as event:
             docDict.update(self.repo.new_document(newdoc,
                                   unresolvedRefs=unresolvedRefs, **docDict))
+            event.fields['gitpubID'] = docDict.get('gitpubID')
+        with self._docmapLock:
             self.docmap[gitpubPath] = docDict
-        for gitpubPath in diff.changedDocs: # update changed docs on remote repo
-            newdoc = Document(self.basepath, gitpubPath, docmap=self.docmap)
-            docDict = copy_kwargs(newmap.dict[gitpubPath])
-            docDict['gitpubHash'] = newdoc.get_hash()
+
+    def push_changed(self, gitpubPath, newmap, unresolvedRefs):
+        'update a changed doc on remote repo, and in our docmap'
+        newdoc, docDict = self.get_push_job(gitpubPath, newmap)
+        with DocEvent(self.eventLog, 'update', self.repo, gitpubPath=gitpubPath,
+                      gitpubID=docDict.get('gitpubID')):
             d = self.repo.set_document(docDict['gitpubID'], newdoc,
                                   unresolvedRefs=unresolvedRefs, **docDict)
-            if d: # allow set_document() to update our document attrs
-                docDict.update(d)
+        if d: # allow set_document() to update our document attrs
+            docDict.update(d)
+        with self._docmapLock:
             self.docmap[gitpubPath] = docDict
-            
-        for gitpubID in diff.deletedDocs: # remove deleted docs from remote repo
+
+    def push_delete(self, gitpubID):
+        'remove a deleted doc from remote repo, and from our docmap'
+        with DocEvent(self.eventLog, 'delete', self.repo, gitpubID=gitpubID,
+                      gitpubPath=self.get_mapped_path(gitpubID)):
             self.repo.delete_document(gitpubID)
+        with self._docmapLock:
             self.docmap.delete_remote_mapping(gitpubID)
-        self.resolve_refs(self.docmap, unresolvedRefs)
-
-    def resolve_refs(self, docmap, unresolvedRefs):
-        'resend docs with unresolved refs, until they resolve'
-        while unresolvedRefs:
-            newUR = set()
-            for doc in unresolvedRefs:
-                docDict = docmap[doc.gitpubPath]
-                self.repo.set_document(docDict['gitpubID'], doc,
-                                       unresolvedRefs=newUR,
-                                       **clean_kwargs(docDict))
-            if len(newUR) >= len(unresolvedRefs):
-                print 'unable to resolve refs!', [doc.title for doc in newUR]
-                return
-            unresolvedRefs = newUR
+
+    def push_new_batch(self, gitpubPaths, newmap, unresolvedRefs):
+        'publish a batch of new docs using repo.new_documents()'
+        jobs = [self.get_push_job(gitpubPath, newmap)
+                for gitpubPath in gitpubPaths]
+        event = DocEvent(self.eventLog, 'upload', self.repo)
+        results = self.repo.new_documents(jobs, unresolvedRefs)
+        for gitpubPath, (newdoc, docDict), result in zip(gitpubPaths, jobs,
+                                                         results):
+            if isinstance(result, Exception):
+                event.write(len(jobs), result, gitpubPath=gitpubPath)
+                self.push_failed(gitpubPath, result, newdoc, unresolvedRefs)
+                continue
+            docDict.update(result)
+            event.write(len(jobs), gitpubPath=gitpubPath,
+                        gitpubID=docDict.get('gitpubID'))
+            with self._docmapLock:
+                self.docmap[gitpubPath] = docDict
+
+    def push_changed_batch(self, gitpubPaths, newmap, unresolvedRefs):
+        'update a batch of changed docs using repo.set_documents()'
+        jobs = [self.get_push_job(gitpubPath, newmap)
+                for gitpubPath in gitpubPaths]
+        event = DocEvent(self.eventLog, 'update', self.repo)
+        results = self.repo.set_documents([(docDict['gitpubID'], newdoc, docDict)
+                                           for newdoc, docDict in jobs],
+                                          unresolvedRefs)
+        for gitpubPath, (newdoc, docDict), result in zip(gitpubPaths, jobs,
+                                                         results):
+            if isinstance(result, Exception):
+                event.write(len(jobs), result, gitpubPath=gitpubPath,
+                            gitpubID=docDict['gitpubID'])
+                self.push_failed(gitpubPath, result, newdoc, unresolvedRefs)
+                continue
+            event.write(len(jobs), gitpubPath=gitpubPath,
+                        gitpubID=docDict['gitpubID'])
+            if result: # allow set_documents() to update our document attrs
+                docDict.update(result)
+            with self._docmapLock:
+                self.docmap[gitpubPath] = docDict
+
+    def push_delete_batch(self, gitpubIDs):
+        'remove a batch of deleted docs using repo.delete_documents()'
+        event = DocEvent(self.eventLog, 'delete', self.repo)
+        results = self.repo.delete_documents(gitpubIDs)
+        for gitpubID, result in zip(gitpubIDs, results):
+            gitpubPath = self.get_mapped_path(gitpubID)
+            if isinstance(result, Exception):
+                event.write(len(gitpubIDs), result, gitpubID=gitpubID,
+                            gitpubPath=gitpubPath)
+                self.delete_failed(gitpubID, result)
+                continue
+            event.write(len(gitpubIDs), gitpubID=gitpubID,
+                        gitpubPath=gitpubPath)
+            with self._docmapLock:
+                self.docmap.delete_remote_mapping(gitpubID)
+
+    def get_mapped_path(self, gitpubID):
+        'gitpubPath mapped to remote doc gitpubID, or None'
+        try:
+            return self.docmap.revDict[gitpubID]['gitpubPath']
+        except KeyError:
+            return None
+
+    def push_failed(self, gitpubPath, e, doc=None, unresolvedRefs=None):
+        '''report a doc that failed within a batch, and clear its gitpubHash
+        so that the next push will send it again'''
+        print >>sys.stderr, 'failed to push %s: %s' % (gitpubPath, e)
+        with self._docmapLock:
+            self.pushErrors[gitpubPath] = e
+            if unresolvedRefs is not None: # already reported here
+                unresolvedRefs.discard(doc)
+            try:
+                del self.docmap[gitpubPath]['gitpubHash']
+            except KeyError:
+                pass
+
+    def delete_failed(self, gitpubID, e):
+        '''report a delete that failed within a batch.  push() keeps its
+        old mapping in failedDeletes, so the next push will delete it again'''
+        print >>sys.stderr, 'failed to delete %s: %s' % (gitpubID, e)
+        with self._docmapLock:
+            self.pushErrors[gitpubID] = e
 
     def fetch_setup(self):
+        '''create our import dir if needed, and return (importDir, docs),
+        where docs iterates over the remote listing's (gitpubID, attr dict)'''
         importDir = os.path.join(self.basepath, self.importDir % self.name)
         if not os.path.isdir(importDir): # create dir if needed
             os.mkdir(importDir)
@@ -353,47 +1056,207 @@ class Remote(object):
             self.repo.get_document
         except AttributeError:
             raise ValueError('this remote does not support fetch!')
-        docDict = self.repo.list_documents()
-        return importDir, docDict
-
-    def fetch_latest(self):
-        'retrieve docs from remote, save changed docs and return them as list'
-        importDir, docDict = self.fetch_setup()
+        try: # stream the listing rather than holding it all in memory
+            docs = self.repo.iter_documents()
+        except AttributeError: # repo only returns the whole listing
+            docs = self.repo.list_documents().iteritems()
+        return importDir, docs
+
+    def fetch_latest(self, maxWorkers=1, maxProcesses=None, chunkSize=100):
+        '''retrieve docs from remote, save changed docs and return them as list.
+        If maxWorkers > 1 and the repo can return raw HTML, downloads
+        use maxWorkers threads and HTML conversion uses a pool of
+        maxProcesses (default: number of CPUs) processes, chunkSize docs
+        at a time.  Docs are still saved one by one in sorted order.
+        Docs whose listed modification stamp matches the one saved in
+        our docmap are skipped without downloading them'''
+        importDir, docs = self.fetch_setup()
+        changed = self.iter_changed_stamps(docs)
+        if maxWorkers > 1 and hasattr(self.repo, 'get_html_document'):
+            return self.fetch_parallel(dict(changed), importDir, maxWorkers,
+                                       maxProcesses, chunkSize)
         l = []
-        for gitpubID in docDict:
-            gitpubPath = self.import_doc(gitpubID, importDir)
+        for gitpubID, stamp in changed: # import each as the listing arrives
+            gitpubPath = self.import_doc(gitpubID, importDir, stamp=stamp)
             if gitpubPath:
                 l.append(gitpubPath)
         return l
 
+    def iter_changed_stamps(self, docs):
+        '''generate (gitpubID, stamp) for docs in remote listing docs that
+        may have changed since our last fetch, skipping docs that our last
+        push failed to delete.  stamp is None if the listing gives no
+        modification stamp for that doc'''
+        for gitpubID, d in docs:
+            if gitpubID in self.failedDeletes: # don't import it back
+                continue
+            stamp = get_modified_stamp(d)
+            try:
+                if stamp and stamp == self.docmap.revDict[gitpubID]['gitpubModified']:
+                    continue
+            except KeyError:
+                pass
+            yield gitpubID, stamp
+
+    def fetch_parallel(self, stamps, importDir, maxWorkers, maxProcesses,
+                       chunkSize):
+        'fetch_latest() via download threads and a conversion process pool'
+        if not stamps:
+            return []
+        import multiprocessing
+        self.repo.check_password() # prompt once, before starting threads
+        pool = multiprocessing.Pool(maxProcesses)
+        l = []
+        try:
+            for chunk in split_batches(sorted(stamps), chunkSize):
+                fetched = map_threaded(self.fetch_html, chunk, maxWorkers)
+                htmls = [t[0] for t in fetched if t]
+                with PhaseTimer('html2rest'): # wait for worker processes
+                    rests = iter(pool.map(try_html_to_rest, htmls))
+                for gitpubID, t in zip(chunk, fetched): # save in order
+                    if not t: # download failed
+                        continue
+                    rest, seconds = rests.next()
+                    DocEvent(self.eventLog, 'convert', gitpubID=gitpubID,
+                             gitpubPath=self.get_mapped_path(gitpubID)).write(
+                        error=rest is None and 'conversion failed' or None,
+                        seconds=seconds)
+                    if rest is None:
+                        print >>sys.stderr, 'failed to convert document %s.  Skipping' % gitpubID
+                        continue
+                    doc, d = self.repo.make_document(rest, t[1])
+                    gitpubPath = self.save_import(self.check_import(gitpubID,
+                                        importDir, doc, d, stamps[gitpubID]))
+                    if gitpubPath:
+                        l.append(gitpubPath)
+        finally:
+            pool.close()
+            pool.join()
+        return l
+
+    def fetch_html(self, gitpubID):
+        'download (html, attr dict) for gitpubID, or None on error'
+        import xmlrpclib
+        try:
+            with DocEvent(self.eventLog, 'fetch', self.repo, gitpubID=gitpubID,
+                          gitpubPath=self.get_mapped_path(gitpubID)):
+                return self.repo.get_html_document(gitpubID)
+        except (StandardError, xmlrpclib.Error), e:
+            print >>sys.stderr, 'failed to get document %s (%s).  Skipping' \
+                  % (gitpubID, e)
+            return None
+
     def import_doc(self, gitpubID, importDir, **kwargs):
         'retrieve the specified doc from the remote repo, save to importDir'
+        return self.save_import(self.get_import(gitpubID, importDir, **kwargs))
+
+    def save_import(self, result):
+        'write (gitpubPath, doc, docDict) from get_import(); return gitpubPath'
+        if result is None:
+            return None
+        gitpubPath, doc, docDict = result
+        if doc is not None: # otherwise only its docDict changed
+            doc.set_path(self.basepath, gitpubPath)
+            doc.write()
+        self.docmap[gitpubPath] = docDict
+        return gitpubPath
+
+    def get_import(self, gitpubID, importDir, stamp=None, **kwargs):
+        '''retrieve the specified doc from the remote repo, and return
+        its (gitpubPath, doc, docDict) without saving anything, or None
+        if it failed or matches our existing content.  stamp is the
+        doc's modification stamp from the remote listing, if any'''
+        import xmlrpclib
+        gitpubPath = self.get_mapped_path(gitpubID)
+        try:
+            if kwargs or not hasattr(self.repo, 'get_html_document'):
+                with DocEvent(self.eventLog, 'fetch', self.repo,
+                              gitpubID=gitpubID, gitpubPath=gitpubPath):
+                    doc, d = self.repo.get_document(gitpubID, **kwargs)
+            else: # log download and conversion separately, as fetch_parallel
+                with DocEvent(self.eventLog, 'fetch', self.repo,
+                              gitpubID=gitpubID, gitpubPath=gitpubPath):
+                    html, d = self.repo.get_html_document(gitpubID)
+                with DocEvent(self.eventLog, 'convert', gitpubID=gitpubID,
+                              gitpubPath=gitpubPath):
+                    rest = html_to_rest(html)
+                doc, d = self.repo.make_document(rest, d)
+        except (StandardError, xmlrpclib.Error):
+            print >>sys.stderr, 'failed to get document %s.  Conversion error? Skipping' % gitpubID
+            return None
+        return self.check_import(gitpubID, importDir, doc, d, stamp)
+
+    def get_import_file(self, gitpubID, importDir, path, **kwargs):
+        '''like get_import(), but have the repo convert the doc straight
+        into file path.  Returns (gitpubPath, docDict), or None if it
+        failed or matches our existing content'''
+        import xmlrpclib
+        try:
+            d = self.repo.save_document(gitpubID, path, **kwargs)
+        except (StandardError, xmlrpclib.Error):
+            print >>sys.stderr, 'failed to get document %s.  Conversion error? Skipping' % gitpubID
+            return None
+        result = self.check_import(gitpubID, importDir, None, d)
+        if result is None:
+            return None
+        return result[0], result[2]
+
+    def check_import(self, gitpubID, importDir, doc, d, stamp=None):
+        '''return (gitpubPath, doc, docDict) for retrieved doc and its
+        attr dict d, or None if it matches our existing content.
+        If only its modification stamp changed, doc is None'''
         try: # use existing file mapping if present
             gitpubPath = self.docmap.revDict[gitpubID]['gitpubPath']
-            path = os.path.join(self.basepath, gitpubPath)
         except KeyError: # use default import path
             path = os.path.join(importDir, gitpubID + '.rst')
             gitpubPath = relpath(path, self.basepath)
-        try:
-            doc, d = self.repo.get_document(gitpubID, **kwargs)
-        except StandardError:
-            print >>sys.stderr, 'failed to get document %s.  Conversion error? Skipping' % gitpubID
-            return None
         docDict = dict(gitpubPath=gitpubPath, gitpubID=gitpubID)
         for k,v in d.items(): # copy relevant attributes from returned dict
             if k.startswith('gitpub'):
                 docDict[k] = v
         if 'gitpubHash' not in docDict:
             docDict['gitpubHash'] = doc.get_hash()
+        if stamp:
+            docDict['gitpubModified'] = stamp
         try:
-            if docDict['gitpubHash'] == self.docmap.revDict[gitpubID]['gitpubHash']:
+            oldDict = self.docmap.revDict[gitpubID]
+            if docDict['gitpubHash'] == oldDict['gitpubHash']:
+                if stamp and stamp != oldDict.get('gitpubModified'):
+                    d = oldDict.copy() # just save its new stamp
+                    d['gitpubModified'] = stamp
+                    return gitpubPath, None, d
                 return None # matches existing content, no need to update
         except KeyError:
             pass
-        doc.set_path(self.basepath, gitpubPath)
-        doc.write()
-        self.docmap[gitpubPath] = docDict
-        return gitpubPath
+        return gitpubPath, doc, docDict
+
+# remote listing fields giving a doc's last modification time, in order
+# of preference (WordPress wp.getPosts, metaWeblog.getRecentPosts...)
+modifiedStampKeys = ('post_modified_gmt', 'post_modified',
+                     'date_modified_gmt', 'date_modified', 'dateModified',
+                     'gitpubModified')
+
+def get_modified_stamp(d):
+    'get modification stamp string from remote listing dict d, or None'
+    try:
+        get = d.get
+    except AttributeError: # not a dict, so no stamp
+        return None
+    for k in modifiedStampKeys:
+        v = get(k)
+        if v:
+            return str(v) # e.g. xmlrpclib.DateTime -> 20120101T12:00:00
+    return None
+
+def refs_unchanged(doc, refs):
+    'True if each image uri in refs still resolves to the same remote path'
+    for uri, remotePath in refs.items():
+        try:
+            if doc.relative_path(uri)['gitpubRemotePath'] != remotePath:
+                return False
+        except (KeyError, TypeError): # not in docmap, or no docmap
+            return False
+    return True
 
 def clean_kwargs(kwargs):
     'return copy of kwargs w/o gitpub* keys'
@@ -429,24 +1292,35 @@ class TrackingBranch(object):
         if doCommit: # need to commit auto-created mapping files
             self.commit('create new tracking branch', False, lastPush=True)
 
-    def merge(self, branchName='master', updateOnly=False):
-        'run git merge and then scan for docmap changes, and commit them'
+    def merge(self, branchName='master', updateOnly=False, rehash=False,
+              gitChanges=False):
+        '''run git merge and then scan for docmap changes, and commit them.
+        Only files whose stat changed are rehashed, unless rehash=True.
+        If gitChanges=True, files whose git blob ID still matches the one
+        recorded in our docmap are skipped without reading them'''
         self.localRepo.checkout(self.branchName)
         if not updateOnly: # skip if user has already run git merge manually
             self.localRepo.merge(branchName)
         mapChanged = self.merge_moves()
         docmap = self.get_stage()
-        mapChanged |= docmap.update(self.localRepo.basepath) # what changed?
+        blobs = None
+        if gitChanges and not rehash: # ask git for every file's blob ID
+            blobs = self.localRepo.get_blob_ids()
+        mapChanged |= docmap.update(self.localRepo.basepath, # what changed?
+                                    self.remote.get_stat_index(), rehash,
+                                    blobs)
         if mapChanged: # need to commit updated doc map
             self.commit('updated %s docmap from %s'
                         % (self.branchName, branchName)) # commit new docmap
         else: # nothing staged, so clear the staging buffer
             del self.stage
 
-    def push(self, branchName='master', updateOnly=False, newmap=None):
+    def push(self, branchName='master', updateOnly=False, newmap=None,
+             maxWorkers=None, rehash=False, gitChanges=False):
         'push changes to remote and commit map changes'
-        self.merge(branchName, updateOnly) # merge changes from branch
-        self.remote.push(newmap) # actually send the changes to the remote
+        self.merge(branchName, updateOnly, rehash, # merge changes from branch
+                   gitChanges)
+        self.remote.push(newmap, maxWorkers) # actually send the changes to the remote
         self.commit(message='publish doc changes to remote %s'
                     % self.remote.name, fromStage=False, lastPush=True)
 
@@ -460,10 +1334,14 @@ class TrackingBranch(object):
         
     def add(self, path, **docDict):
         'add a file to be staged for next commit'
-        gitpubPath = relpath(path, self.localRepo.basepath)
-        self.localRepo.add(path)
+        self.add_paths((path,), **docDict)
+
+    def add_paths(self, paths, **docDict):
+        'add files to be staged for next commit, with a single git add'
+        self.localRepo.add(*paths)
         docmap = self.get_stage()
-        docmap[gitpubPath] = docDict
+        for path in paths:
+            docmap[relpath(path, self.localRepo.basepath)] = docDict.copy()
 
     def rm(self, path):
         'stage a file to be deleted in next commit'
@@ -529,63 +1407,142 @@ class TrackingBranch(object):
             self.localRepo.checkout(self.branchName)
         if fromStage:
             self.remote.docmap = self.stage
-        self.localRepo.add(self.remote.save_doc_map())
+        paths = [self.remote.save_doc_map()]
         if lastPush: # save copy of mapping as last synch with remote
-            self.localRepo.add(self.remote.save_doc_map(lastPush=True))
+            paths.append(self.remote.save_doc_map(lastPush=True))
+        self.localRepo.add(*paths)
         self.localRepo.commit(message=message)
         repoState.pop()
         if fromStage:
             del self.stage # moved this docmap to self.remote...
 
-    def fetch_latest(self):
+    def fetch_latest(self, maxWorkers=1):
         'fetch latest state from remote, and commit any changes in this branch'
-        newdocs = self.remote.fetch_latest()
+        newdocs = self.remote.fetch_latest(maxWorkers)
         if len(newdocs) == 0:
             return False
-        for gitpubPath in newdocs:
-            self.localRepo.add(os.path.join(self.localRepo.basepath, gitpubPath))
+        self.localRepo.add(*[os.path.join(self.localRepo.basepath, gitpubPath)
+                             for gitpubPath in newdocs])
         return True
 
-    def fetch_doc_history(self, history_f):
-        'commit each doc revision in temporal order'
-        importDir, docDict = self.remote.fetch_setup()
+    def fetch_doc_history(self, history_f, fastImport=True):
+        '''commit each doc revision in temporal order, streaming them all
+        through a single git fast-import run unless fastImport=False.
+        Only revisions newer than each doc's gitpubLastRev are retrieved'''
+        importDir, docs = self.remote.fetch_setup()
         l = []
-        for gitpubID in docDict:
-            docHistory = history_f(gitpubID)
+        for gitpubID, d in docs:
+            try: # high-water mark: last revision we imported
+                sinceRev = self.remote.docmap.revDict[gitpubID]['gitpubLastRev']
+            except KeyError:
+                sinceRev = None
+            docHistory = history_f(gitpubID, sinceRev)
             for revID, d in docHistory.items():
                 l.append((d['timestamp'], gitpubID, revID, d))
         if len(l) == 0:
             return False
         l.sort() # sort in temporal order
-        revCommits = {}
+        if fastImport:
+            return self.fast_import_history(l, importDir)
         for t, gitpubID, revID, d in l:
             try:
-                if revID in self.remote.docmap[gitpubPath]['revCommit']:
-                    continue # already retrieved & committed this file rev
+                revCommit = self.remote.docmap.revDict[gitpubID]['revCommit']
             except KeyError:
-                pass
+                revCommit = {}
+            if revID in revCommit:
+                continue # already retrieved & committed this file rev
             gitpubPath = self.remote.import_doc(gitpubID, importDir, revID=revID)
+            if not gitpubPath: # failed, or same content as last rev
+                self.set_last_rev(gitpubID, revID)
+                continue
             self.localRepo.add(os.path.join(self.localRepo.basepath, gitpubPath))
             commitID = self.localRepo.commit('%s revision %s on %s'
                                              % (t.ctime(), str(revID), str(gitpubID)))
             d2 = self.remote.docmap[gitpubPath]
-            try: # save the commit ID mapping info
-                revCommits[gitpubPath][revID] = commitID
-            except KeyError:
-                revCommits[gitpubPath] = {revID:commitID}
-            d2['revCommit'] = revCommits[gitpubPath]
+            revCommit[revID] = commitID # save the commit ID mapping info
+            d2['revCommit'] = revCommit
             self.remote.docmap[gitpubPath] = d2 # save updated metadata
+            self.set_last_rev(gitpubID, revID)
+        return True
+
+    def set_last_rev(self, gitpubID, revID):
+        'record revID as the last revision of gitpubID we have processed'
+        try:
+            d = self.remote.docmap.revDict[gitpubID]
+        except KeyError: # never imported, so nothing to record
+            return False
+        if d.get('gitpubLastRev') == revID:
+            return False
+        d['gitpubLastRev'] = revID
         return True
 
-    def fetch(self):
-        'fetch doc history (if repo supports this) or latest snapshot'
+    def fast_import_history(self, revisions, importDir):
+        '''commit (timestamp, gitpubID, revID, revInfo) revisions in order,
+        via git fast-import, then save their revCommit mappings'''
+        imported = [] # (gitpubPath, revID) for each commit, in order
+        marksMoved = [] # gitpubIDs whose gitpubLastRev changed
+        if hasattr(self.remote.repo, 'save_document'): # stream via temp file
+            tmpPath = os.path.join(get_local_dir(self.localRepo.basepath,
+                                                 'tmp'), 'import.rst')
+        else:
+            tmpPath = None
+        def get_commits():
+            for t, gitpubID, revID, d in revisions:
+                try:
+                    if revID in self.remote.docmap.revDict[gitpubID]['revCommit']:
+                        continue # already retrieved & committed this file rev
+                except KeyError:
+                    pass
+                if tmpPath:
+                    result = self.remote.get_import_file(gitpubID, importDir,
+                                                         tmpPath, revID=revID)
+                else:
+                    result = self.remote.get_import(gitpubID, importDir,
+                                                    revID=revID)
+                if result is None: # failed, or same content as last rev
+                    if self.set_last_rev(gitpubID, revID):
+                        marksMoved.append(gitpubID)
+                    continue
+                if tmpPath: # fast_import streams it, then closes it
+                    gitpubPath, docDict = result
+                    data = open(tmpPath, 'rb')
+                else:
+                    gitpubPath, doc, docDict = result
+                    data = doc.get_data()
+                try: # keep revCommit mappings from previous fetches
+                    docDict['revCommit'] = self.remote.docmap[gitpubPath]['revCommit']
+                except KeyError:
+                    docDict['revCommit'] = {}
+                docDict['gitpubLastRev'] = revID
+                self.remote.docmap[gitpubPath] = docDict
+                imported.append((gitpubPath, revID))
+                message = '%s revision %s on %s' % (t.ctime(), str(revID),
+                                                   str(gitpubID))
+                if d.get('comment'):
+                    message += '\n\n' + d['comment']
+                yield dict(files=((gitpubPath, data),),
+                           message=message, author=d.get('author'),
+                           timestamp=int(time.mktime(t.timetuple())))
+        try:
+            commitIDs = self.localRepo.fast_import(self.branchName,
+                                                   get_commits())
+        finally:
+            if tmpPath and os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        for (gitpubPath, revID), commitID in zip(imported, commitIDs):
+            self.remote.docmap[gitpubPath]['revCommit'][revID] = commitID
+        return len(commitIDs) > 0 or len(marksMoved) > 0
+
+    def fetch(self, maxWorkers=1):
+        '''fetch doc history (if repo supports this) or latest snapshot,
+        the latter using up to maxWorkers concurrent downloads'''
         repoState = self.localRepo.push_state()
         self.localRepo.checkout(self.branchName)
         try:
             history_f = self.remote.repo.get_document_history
             msg = 'updated doc mappings and revision history from fetch'
         except AttributeError:
-            doCommit = self.fetch_latest()
+            doCommit = self.fetch_latest(maxWorkers)
             msg = 'fetch from remote'
         else:
             doCommit = self.fetch_doc_history(history_f)
@@ -607,6 +1564,7 @@ except AttributeError: # for earlier python versions
             raise ValueError('path not inside basepath!')
     
 
+@PhaseTimer('git')
 def run_subprocess(args, errmsg):
     'raise OSError if nonzero exit code'
     p = Popen(args)
@@ -614,6 +1572,53 @@ def run_subprocess(args, errmsg):
     if p.returncode:
         raise OSError(errmsg % p.returncode)
 
+@PhaseTimer('git')
+def get_subprocess_output(args, errmsg, cwd=None):
+    'return stdout of command, or raise OSError if nonzero exit code'
+    p = Popen(args, stdout=PIPE, cwd=cwd)
+    output = p.communicate()[0]
+    if p.returncode:
+        raise OSError(errmsg % p.returncode)
+    return output
+
+
+def write_fast_import_commit(ofile, branchName, mark, c, committer,
+                             parent=None):
+    'write commit dict c to a git fast-import stream'
+    when = '%d +0000' % c['timestamp']
+    message = c['message']
+    if isinstance(message, unicode):
+        message = message.encode('utf-8')
+    print >>ofile, 'commit refs/heads/%s' % branchName
+    print >>ofile, 'mark :%d' % mark
+    author = c.get('author')
+    if author:
+        if '<' not in author: # git requires an email, even if empty
+            author += ' <>'
+        if isinstance(author, unicode):
+            author = author.encode('utf-8')
+        print >>ofile, 'author %s %s' % (author, when)
+    print >>ofile, 'committer %s %s' % (committer, when)
+    print >>ofile, 'data %d' % len(message)
+    print >>ofile, message
+    if parent:
+        print >>ofile, 'from %s' % parent
+    for path, data in c['files']:
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        print >>ofile, 'M 100644 inline %s' % path
+        if isinstance(data, str):
+            print >>ofile, 'data %d' % len(data)
+            ofile.write(data)
+        else: # open file: copy it in chunks
+            try:
+                print >>ofile, 'data %d' % os.fstat(data.fileno()).st_size
+                shutil.copyfileobj(data, ofile)
+            finally:
+                data.close()
+        print >>ofile
+    print >>ofile
+
 
 class GitRepoState(object):
     def __init__(self, repo):
@@ -625,6 +1630,7 @@ class GitRepoState(object):
         
 
 class GitRepo(object):
+    maxArgs = 500 # max paths to pass to a single git add / git rm
     def __init__(self, basepath=None):
         'basepath should be top of the git repository, i.e. dir containing .git dir'
         if basepath is None:
@@ -636,28 +1642,38 @@ class GitRepo(object):
                 if len(basepath) <= 1: # root directory
                     raise ValueError('not inside a git repository!')
         self.basepath = basepath
-        self.branches = self.list_branches()
+        self.branches = self.list_branches() # cached, current branch first
 
     def checkout(self, branchname):
         'git checkout <branchname>'
-        if branchname == self.list_branches()[0]:
+        if branchname == self.branches[0]:
             return # already on this branch, no need to do anything
         run_subprocess(('git', 'checkout', branchname), 'git checkout error %d')
-        self.branches = self.list_branches()
+        self.set_current_branch(branchname)
+
+    def set_current_branch(self, branchname):
+        'update our cached branch list to show branchname as current branch'
+        if branchname in self.branches:
+            self.branches.remove(branchname)
+        self.branches.insert(0, branchname)
 
     def merge(self, branchName):
         'git merge <branchName>'
         run_subprocess(('git', 'merge', branchName), 'git merge error %d')
 
-    def add(self, path):
-        'git add <path>'
-        path = relpath(path) # relative to current directory
-        run_subprocess(('git', 'add', path), 'git add error %d')
+    def add(self, *paths):
+        'git add <path1> <path2> ..., in as few git runs as possible'
+        paths = [relpath(path) for path in paths] # relative to current directory
+        for chunk in split_batches(paths, self.maxArgs):
+            run_subprocess(('git', 'add', '--') + tuple(chunk),
+                           'git add error %d')
 
-    def rm(self, path):
-        'git rm <path>'
-        path = relpath(path) # relative to current directory
-        run_subprocess(('git', 'rm', path), 'git rm error %d')
+    def rm(self, *paths):
+        'git rm <path1> <path2> ..., in as few git runs as possible'
+        paths = [relpath(path) for path in paths] # relative to current directory
+        for chunk in split_batches(paths, self.maxArgs):
+            run_subprocess(('git', 'rm', '--') + tuple(chunk),
+                           'git rm error %d')
 
     def _mv(self, oldpath, newpath):
         'internal interface to run git mv <oldpath> <newpath>'
@@ -668,19 +1684,19 @@ class GitRepo(object):
     def commit(self, message):
         'commit and return its commit ID'
         run_subprocess(('git', 'commit', '-m', message), 'git commit error %d')
-        l = Popen(["git", "log", 'HEAD^..HEAD'], stdout=PIPE).communicate()[0].split('\n')
-        return l[0].split()[1] # return our commit ID
+        return self.get_last_commit_id() # return our commit ID
 
     def branch(self, branchname=None):
         'create new branch, or return current branch'
-        if branchname == self.list_branches()[0]:
+        if branchname == self.branches[0]:
             return # already on this branch, no need to do anything
         elif branchname: # switch to specified branch
             run_subprocess(('git', 'branch', branchname), 'git branch error %d')
             self.branches.append(branchname)
         else: # get the current branch name
-            return self.list_branches()[0]
+            return self.branches[0]
 
+    @PhaseTimer('git')
     def list_branches(self):
         'list existing branches, with current branch first'
         l = Popen(["git", "branch"], stdout=PIPE).communicate()[0].split('\n')[:-1]
@@ -693,9 +1709,72 @@ class GitRepo(object):
 
     def get_last_commit_id(self):
         'get ID of the most recent commit'
-        return Popen(['git', 'log', '--pretty=oneline', '-1'], stdout=PIPE).\
-            communicate()[0].split()[0]
+        return get_subprocess_output(('git', 'rev-parse', 'HEAD'),
+                                     'git rev-parse error %d').strip()
         
+    def fast_import(self, branchName, commits):
+        '''stream commits onto the end of branchName (which must be
+        checked out) via a single git fast-import run, then update the
+        working tree to match.  commits is an iterable of dicts with keys
+        files (sequence of (path, data) pairs, where data is a string or
+        an open file, which is streamed and then closed), message,
+        timestamp (in seconds since the epoch) and optionally author.
+        Returns list of the new commit IDs'''
+        oldHead = self.get_last_commit_id()
+        committer = get_subprocess_output(('git', 'var', 'GIT_COMMITTER_IDENT'),
+                                          'git var error %d').strip()
+        committer = committer.rsplit(' ', 2)[0] # drop its timestamp
+        marksFile = tempfile.NamedTemporaryFile(suffix='.marks', delete=False)
+        marksFile.close()
+        try:
+            with PhaseTimer('git'): # not the commits iterator, which may do RPC
+                p = Popen(('git', 'fast-import', '--quiet',
+                           '--export-marks=' + marksFile.name),
+                          stdin=PIPE, cwd=self.basepath)
+            n = 0
+            try:
+                for c in commits:
+                    n += 1
+                    write_fast_import_commit(p.stdin, branchName, n, c,
+                                             committer, n == 1 and oldHead)
+            finally:
+                with PhaseTimer('git'):
+                    p.stdin.close()
+                    p.wait()
+            if p.returncode:
+                raise OSError('git fast-import error %d' % p.returncode)
+            marks = {}
+            for line in _read(open(marksFile.name)).splitlines():
+                mark, commitID = line.split()
+                marks[mark] = commitID
+        finally:
+            os.remove(marksFile.name)
+        commitIDs = [marks[':%d' % i] for i in range(1, n + 1)]
+        if commitIDs: # bring index and working tree up to the new head
+            run_subprocess(('git', 'read-tree', '-m', '-u', oldHead,
+                            commitIDs[-1]), 'git read-tree error %d')
+        return commitIDs
+
+    def get_blob_ids(self):
+        '''get {path: blobID} for every tracked file in the working tree,
+        from a single git diff-index run against the empty tree.  blobID
+        is None for files edited since they were last git added, whose
+        new blob git has not computed yet'''
+        d = {}
+        output = get_subprocess_output(('git', 'diff-index', '-r', '-z',
+                                        '--no-renames', emptyTreeID),
+                                       'git diff-index error %d', self.basepath)
+        l = output.split('\0')[:-1] # alternating info, path fields
+        for info, path in zip(l[0::2], l[1::2]):
+            # :oldmode newmode oldblob newblob status
+            oldmode, newmode, oldblob, newblob, status = info.split()
+            if status == 'D': # deleted from working tree
+                continue
+            if newblob == nullBlobID: # edited, not yet hashed by git
+                newblob = None
+            d[path] = newblob
+        return d
+
     def get_move_dict(self, filename='_git_moves.json'):
         'read moves-registry dict stored using JSON'
         path = os.path.join(self.basepath, '.gitpub', filename)
@@ -738,6 +1817,8 @@ tracking branch.''')
 
 class RepoBase(object):
     '''Base class for plugin Repo classes, e.g. see plugins/blogger.py '''
+    renderCache = None # Remote gives us a RenderCache
+    eventLog = None # and an EventLog
     def __init__(self, host, user, password=None, blog_id=0):
         self.host = host
         self.user = user
@@ -755,20 +1836,47 @@ class RepoBase(object):
         'post a restructured text file to wordpress as post or page'
         self.check_password()
         if hasattr(doc, 'rest'):
-            html = self.convert_rest(doc, unresolvedRefs)
+            html = self.get_html(doc, gitpubHash, unresolvedRefs)
         else:
             return self.upload_file(doc)
-        if gitpubHash: # insert our hash code as HTML comment
-            html += '\n<!-- gitpubHash=%s -->\n' % gitpubHash
-        d = dict(title=doc.title, description=html)
         if pubtype == 'page':
             gitpubID = 'page:' + str(self.new_page(doc.title, html, publish))
         else:
             gitpubID = 'post:' + str(self.new_post(doc.title, html, publish))
         return dict(gitpubID=gitpubID, gitpubRemotePath='/?p=' + gitpubID[5:])
 
+    def render_rest(self, doc, writer):
+        '''render doc with writer, using our render cache if possible.
+        writer must record its image refs, as rst2wp.Writer does'''
+        with DocEvent(self.eventLog, 'render',
+                      gitpubPath=getattr(doc, 'gitpubPath', None)) as event:
+            if self.renderCache is None:
+                return doc.render(writer)
+            key = self.renderCache.get_key(doc.get_hash(),
+                                           writer.gitpubTranslator)
+            entry = self.renderCache.get(key)
+            if entry is not None and refs_unchanged(doc, entry['refs']):
+                if not hasattr(doc, '_title'): # no need to parse it for title
+                    doc.title = entry['title']
+                event.fields['cached'] = True
+                return entry['html'].encode('utf-8')
+            html = doc.render(writer)
+            if None not in writer.gitpubRefs.values(): # all refs resolved
+                self.renderCache.put(key, dict(html=html.decode('utf-8'),
+                                               title=doc.title,
+                                               refs=writer.gitpubRefs))
+            return html
+
+    def get_html(self, doc, gitpubHash=None, unresolvedRefs=None):
+        'convert doc to HTML, with our hash code inserted as HTML comment'
+        html = self.convert_rest(doc, unresolvedRefs)
+        if gitpubHash:
+            html += '\n<!-- gitpubHash=%s -->\n' % gitpubHash
+        return html
+
     def upload_file(self, doc, doc_id=None):
         'upload file to WP server for inclusion in documents'
+        import xmlrpclib
         if doc_id:
             wpName = doc_id.split('/')[-1]
             if wpName.startswith('wpid-'):
@@ -795,6 +1903,11 @@ class RepoBase(object):
 
     def get_document(self, doc_id):
         'retrieve the specified post or page and convert to ReST'
+        html, result = self.get_html_document(doc_id)
+        return self.make_document(html_to_rest(html), result)
+
+    def get_html_document(self, doc_id):
+        'retrieve the specified post or page as (html, attr dict)'
         self.check_password()
         pubtype, pub_id = self._get_pubtype_id(doc_id)
         if pubtype == 'page':
@@ -810,14 +1923,12 @@ class RepoBase(object):
             html = html[:i-5] + html[i + j + 1:] # remove inserted comment
         except ValueError:
             pass
-        buf = StringIO()
-        parser = html2rest.Parser(buf)
-        parser.feed(html)
-        parser.close()
-        rest = buf.getvalue()
-        doc = core.Document(rest=rest, title=result.get('title', 'Untitled'))
         result['gitpubRemotePath'] = '/?p=' + pub_id
-        return doc, result
+        return html, result
+
+    def make_document(self, rest, result):
+        'create Document from converted ReST text, return (doc, result)'
+        return Document(rest=rest, title=result.get('title', 'Untitled')), result
             
     def set_document(self, doc_id, doc, publish=True, gitpubHash=None,
                      unresolvedRefs=None, *args, **kwargs):
@@ -826,10 +1937,7 @@ class RepoBase(object):
         pubtype, pub_id = self._get_pubtype_id(doc_id)
         if pubtype == 'file':
             return self.upload_file(doc, doc_id)
-        html = self.convert_rest(doc, unresolvedRefs)
-        if gitpubHash: # insert our hash code as HTML comment
-            html += '\n<!-- gitpubHash=%s -->\n' % gitpubHash
-        d = dict(title=doc.title, description=html)
+        html = self.get_html(doc, gitpubHash, unresolvedRefs)
         if pubtype == 'page':
             v = self.update_page(pub_id, doc.title, html, publish)
         elif pubtype == 'post':
@@ -854,17 +1962,18 @@ class RepoBase(object):
         if not v:
             raise ValueError('xmlrpc server method failed: check your args')
 
-    def list_documents(self, maxposts=2000):
+    def list_documents(self, maxposts=None):
         'get list of posts and pages from server, return as dictionary'
+        return dict(self.iter_documents(maxposts))
+
+    def iter_documents(self, maxposts=None):
+        '''generate (doc_id, attr dict) for posts and pages on the server,
+        without holding the whole listing in memory'''
         self.check_password()
-        d = {}
-        l = self.get_post_list(maxposts)
-        for kwargs in l:
-            d['post:' + str(kwargs['postid'])] = kwargs
-        l = self.get_page_list(maxposts)
-        for kwargs in l:
-            d['page:' + str(kwargs['page_id'])] = kwargs
-        return d
+        for kwargs in self.get_post_list(maxposts):
+            yield 'post:' + str(kwargs.get('post_id') or kwargs['postid']), kwargs
+        for kwargs in self.get_page_list(maxposts):
+            yield 'page:' + str(kwargs.get('post_id') or kwargs['page_id']), kwargs
 
 
 
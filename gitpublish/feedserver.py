@@ -0,0 +1,123 @@
+'''In-process stand-in for Blogger's Atom post and page feeds, for
+exercising the blogger plugin's paged listing offline, e.g.
+
+  server = start_server()
+  server.add_entries('posts', 250)
+  repo = Repo(None, 'user', 'x', blog_id=server.blogID,
+              feedHost=server.hostname)
+
+serves /feeds/<blogID>/<posts|pages>/default a page at a time, honouring
+max-results and start-index, with a next link on every page but the
+last.  Records each request, to check paging without a live blog.
+'''
+
+import BaseHTTPServer
+import cgi
+import SocketServer
+import threading
+import time
+import urllib
+import urlparse
+from xml.sax.saxutils import escape
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 4 or parts[0] != 'feeds' or parts[3] != 'default' \
+               or parts[1] != self.server.blogID \
+               or parts[2] not in self.server.entries:
+            self.send_error(404)
+            return
+        query = cgi.parse_qs(url.query)
+        try:
+            maxResults = int(query.get('max-results',
+                                       [self.server.defaultPageSize])[0])
+            startIndex = int(query.get('start-index', [1])[0])
+        except ValueError:
+            self.send_error(400)
+            return
+        data = self.server.get_feed(parts[2], startIndex, maxResults)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/atom+xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args): # keep benchmark output clean
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''Atom feed server for one blog, one thread per connection.
+    defaultPageSize: entries per page when a request omits max-results
+    maxPageSize: most entries per page, whatever max-results asks for'''
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, blogID='1234',
+                 defaultPageSize=25, maxPageSize=500):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), RequestHandler)
+        self.hostname = '%s:%d' % self.server_address # for feedHost=
+        self.blogID = blogID
+        self.defaultPageSize = defaultPageSize
+        self.maxPageSize = maxPageSize
+        self.lock = threading.Lock()
+        self.entries = dict(posts=[], pages=[]) # (id, title, updated) tuples
+        self.requests = [] # (feedType, startIndex, maxResults, nentries)
+
+    def add_entries(self, feedType, n):
+        'add n entries to the posts or pages feed'
+        kind = feedType[:-1] # post or page
+        with self.lock:
+            l = self.entries[feedType]
+            for i in range(len(l), len(l) + n):
+                l.append(('tag:blogger.com,1999:blog-%s.%s-%d'
+                          % (self.blogID, kind, 1000 + i),
+                          '%s %d' % (kind, i),
+                          time.strftime('%Y-%m-%dT%H:%M:%S.000Z',
+                                        time.gmtime(1300000000 + i))))
+
+    def get_feed(self, feedType, startIndex, maxResults):
+        'Atom feed XML for maxResults entries from 1-based startIndex'
+        maxResults = min(maxResults, self.maxPageSize)
+        with self.lock:
+            l = self.entries[feedType]
+            page = l[startIndex - 1:startIndex - 1 + maxResults]
+            self.requests.append((feedType, startIndex, maxResults, len(page)))
+            more = startIndex - 1 + maxResults < len(l)
+        uri = 'http://%s/feeds/%s/%s/default' % (self.hostname, self.blogID,
+                                                 feedType)
+        xml = ['<?xml version="1.0" encoding="UTF-8"?>',
+               '<feed xmlns="http://www.w3.org/2005/Atom" '
+               'xmlns:openSearch="http://a9.com/-/spec/opensearchrss/1.0/">',
+               '<id>tag:blogger.com,1999:blog-%s.%s</id>' % (self.blogID,
+                                                             feedType),
+               '<title>stand-in blog</title>',
+               '<openSearch:totalResults>%d</openSearch:totalResults>' % len(l),
+               '<openSearch:startIndex>%d</openSearch:startIndex>' % startIndex,
+               '<openSearch:itemsPerPage>%d</openSearch:itemsPerPage>'
+               % maxResults]
+        if more:
+            xml.append('<link rel="next" type="application/atom+xml" '
+                       'href="%s" />' % escape(uri + '?' + urllib.urlencode(
+                           [('start-index', startIndex + maxResults),
+                            ('max-results', maxResults)])))
+        for entryID, title, updated in page:
+            xml += ['<entry>', '<id>%s</id>' % entryID,
+                    '<updated>%s</updated>' % updated,
+                    '<title type="text">%s</title>' % escape(title),
+                    '<content type="html">%s</content>'
+                    % escape('<p>%s</p>' % title), '</entry>']
+        xml.append('</feed>')
+        return '\n'.join(xml)
+
+
+def start_server(host='127.0.0.1', port=0, **kwargs):
+    '''start a Server in a daemon thread, and return it.
+    kwargs are passed to Server, e.g. defaultPageSize=10'''
+    server = Server(host, port, **kwargs)
+    t = threading.Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+    return server
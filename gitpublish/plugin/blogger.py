@@ -1,6 +1,6 @@
-from docutils.core import publish_string
 from translator import html2rest, rst2blogger
 from gitpublish import core
+import threading
 import warnings
 try:
     import gdata.blogger.client
@@ -12,10 +12,19 @@ except ImportError:
 
 class Repo(core.RepoBase):
     'standard interface to a Blogger blog'
-    def __init__(self, host, user, password=None, blog_id=0):
-        'for blogger service, host arg is ignored'
+    def __init__(self, host, user, password=None, blog_id=0,
+                 feedHost='www.blogger.com', listPageSize=100):
+        '''for blogger service, host arg is ignored.  feedHost is where
+        post & page feeds are read from, listPageSize entries per request'''
         core.RepoBase.__init__(self, host, user, password, blog_id)
         self.client = gdata.blogger.client.BloggerClient()
+        self.client.request = core.PhaseTimer('rpc')(self.client.request)
+        self.feedHost = feedHost
+        self.listPageSize = int(listPageSize)
+        self._postIndex = {} # {post_id:post} for posts listed or written
+        self._pageIndex = {} # {page_id:page} likewise
+        self._indexed = set() # feed types whose whole feed was listed
+        self._indexLock = threading.Lock()
 
     def check_password(self, attr='password'):
         core.RepoBase.check_password(self, attr)
@@ -31,13 +40,17 @@ class Repo(core.RepoBase):
         'create post with specified title and HTML content'
         post = self.client.add_post(self.blog_id, title, content,
                                     draft=not publish)
-        return post.get_post_id()
+        post_id = post.get_post_id()
+        self._postIndex[post_id] = post
+        return post_id
 
     def new_page(self, title, content, publish=True):
         'create page with specified title and HTML content'
         page = self.client.add_page(self.blog_id, title, content,
                                     draft=not publish)
-        return page.get_page_id()
+        page_id = page.get_page_id()
+        self._pageIndex[page_id] = page
+        return page_id
 
     def get_blog(self):
         'get blog object for this blog'
@@ -53,53 +66,112 @@ class Repo(core.RepoBase):
 
     def _find_post(self, post_id):
         'get post object for specified post'
-        blog = self.get_blog()
-        post = self.client.get_feed(
-            blog.get_post_link().href + '/%s' % post_id,
-            auth_token=self.client.auth_token,
-            desired_class=gdata.blogger.data.BlogPost)
-        return post
+        return self._find_entry('posts', post_id)
 
     def update_post(self, post_id, title, content, publish=True):
         'update with new title and content'
         post = self._find_post(post_id)
         post.title = atom.data.Title(title)
         post.content = atom.data.Content(content)
-        return self.client.update(post)
+        post = self.client.update(post)
+        self._postIndex[post_id] = post # keep its new edit link / etag
+        return post
 
-    def get_post_list(self, maxposts=2000):
-        'maxposts ignored currently...'
-        feed = self.client.get_posts(self.blog_id)
-        return feed.entry
+    def get_post_list(self, maxposts=None):
+        'generate post entries, up to maxposts (None means all)'
+        return self._get_feed_entries('posts', gdata.blogger.data.BlogPostFeed,
+                                      maxposts)
     
-    def get_page_list(self, maxpages=2000):
-        'maxpages ignored currently...'
-        feed = self.client.get_pages(self.blog_id)
-        return feed.entry
+    def get_page_list(self, maxpages=None):
+        'generate page entries, up to maxpages (None means all)'
+        return self._get_feed_entries('pages', gdata.blogger.data.BlogPageFeed,
+                                      maxpages)
+
+    def _get_feed_entries(self, feedType, feedClass, maxEntries=None):
+        '''generate entries of this blog's posts or pages feed, reading
+        listPageSize entries per request and following each feed page's
+        next link, until maxEntries have been generated.  Adds each entry
+        to our post or page index as it goes'''
+        index, getID = dict(posts=(self._postIndex, 'get_post_id'),
+                            pages=(self._pageIndex, 'get_page_id'))[feedType]
+        n = self.listPageSize
+        if maxEntries is not None:
+            n = min(n, maxEntries)
+        uri = 'http://%s/feeds/%s/%s/default' % (self.feedHost, self.blog_id,
+                                                 feedType)
+        query = gdata.blogger.client.Query(max_results=n)
+        count = 0
+        while uri and (maxEntries is None or count < maxEntries):
+            feed = self.client.get_feed(uri, auth_token=self.client.auth_token,
+                                        desired_class=feedClass, query=query)
+            for entry in feed.entry:
+                index[getattr(entry, getID)()] = entry
+                yield entry
+                count += 1
+                if count == maxEntries:
+                    return
+            uri = feed.find_next_link() # already includes max-results
+            query = None
+        self._indexed.add(feedType) # listed it all
+
+    def iter_documents(self, maxposts=None):
+        'generate (doc_id, attr dict) for posts and pages, one feed page at a time'
+        self.check_password()
+        for post in self.get_post_list(maxposts):
+            yield 'post:' + post.get_post_id(), self._entry_dict(post)
+        for page in self.get_page_list(maxposts):
+            yield 'page:' + page.get_page_id(), self._entry_dict(page)
+
+    def _entry_dict(self, entry):
+        'attr dict for feed entry'
+        d = dict(title=entry.title.text)
+        if entry.updated is not None:
+            d['gitpubModified'] = entry.updated.text
+        return d
     
+    def _find_entry(self, feedType, entryID):
+        '''get post or page entry from our index, listing its whole feed
+        once if it isn't there.  Only one thread lists a feed'''
+        index = dict(posts=self._postIndex, pages=self._pageIndex)[feedType]
+        try:
+            return index[entryID]
+        except KeyError:
+            pass
+        with self._indexLock:
+            if feedType not in self._indexed: # unless another thread just did
+                for entry in dict(posts=self.get_post_list,
+                                  pages=self.get_page_list)[feedType]():
+                    pass
+        try:
+            return index[entryID]
+        except KeyError:
+            raise ValueError('no %s matching id %s??'
+                             % (feedType[:-1], entryID))
+
     def _find_page(self, page_id):
         'get page object for specified page'
-        for page in self.get_page_list():
-            if page.get_page_id() == page_id:
-                return page
-        raise ValueError('no page matching page_id??')
+        return self._find_entry('pages', page_id)
 
     def update_page(self, page_id, title, content, publish=True):
         'update with new title and content'
         page = self._find_page(page_id)
         page.title = atom.data.Title(title)
         page.content = atom.data.Content(content)
-        return self.client.update(page)
+        page = self.client.update(page)
+        self._pageIndex[page_id] = page # keep its new edit link / etag
+        return page
         
     def delete_post(self, post_id):
         'delete specified post'
-        post = self.get_post(post_id)
+        post = self._find_post(post_id)
         self.client.delete(post)
+        self._postIndex.pop(post_id, None)
 
     def delete_page(self, page_id):
         'delete specified page'
-        page = self.get_page(page_id)
+        page = self._find_page(page_id)
         self.client.delete(page)
+        self._pageIndex.pop(page_id, None)
 
     def delete_file(self, doc_id):
         warnings.warn('blogger lacks file deletion function... ignoring.')
@@ -120,6 +192,5 @@ class Repo(core.RepoBase):
     def convert_rest(self, doc, unresolvedRefs=None):
         'convert ReST to Blogger html using docutils, rst2blogger'
         writer = rst2blogger.Writer(doc, unresolvedRefs)
-        return publish_string(doc.rest, writer=writer, # blogger format
-                              settings_overrides=dict(report_level=5))
+        return self.render_rest(doc, writer) # blogger format
 
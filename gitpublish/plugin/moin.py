@@ -4,6 +4,7 @@ import datetime
 from StringIO import StringIO
 import textwrap
 import re
+from gitpublish import core
 
 class Repo(object):
     def __init__(self, wikiDir):
@@ -16,17 +17,61 @@ class Repo(object):
             d[os.path.basename(path)] = {} # no metadata
         return d
 
-    def get_document_history(self, doc_id):
-        'get dictionary of revisions of this doc, each with dict containing timestamp'
+    def get_document_history(self, doc_id, sinceRev=None):
+        '''get dictionary of revisions of this doc, each with dict containing
+        timestamp, plus author and comment if recorded in its edit-log.
+        If sinceRev is given, only revisions after it are included'''
         d = {}
         for path in glob.glob(self.wikiDir + '/data/pages/%s/revisions/0*' % doc_id):
             revID = os.path.basename(path)
+            if sinceRev is not None and int(revID) <= int(sinceRev):
+                continue # already imported
             d[revID] = dict(timestamp=datetime.datetime.fromtimestamp(os.stat(path)
                                                                       .st_mtime))
+        for revID, author, comment in self.read_edit_log(doc_id):
+            try:
+                if author:
+                    d[revID]['author'] = author
+                if comment:
+                    d[revID]['comment'] = comment
+            except KeyError: # no such revision file
+                pass
         return d
 
-    def get_document(self, doc_id, revID=None):
-        'retrieve the specified post or page and convert to ReST'
+    def read_edit_log(self, doc_id):
+        'generate (revID, author, comment) from this page\'s edit-log, if any'
+        try:
+            ifile = open(os.path.join(self.wikiDir, 'data', 'pages', doc_id,
+                                      'edit-log'))
+        except IOError:
+            return
+        try:
+            for line in ifile:
+                fields = line.rstrip('\r\n').split('\t')
+                if len(fields) < 9: # mtime rev action page addr host user extra comment
+                    continue
+                author = self.get_user_name(fields[6]) or fields[5]
+                yield fields[1], author, fields[8].decode('utf-8', 'replace')
+        finally:
+            ifile.close()
+
+    def get_user_name(self, userID):
+        'get wiki name of userID from its user profile, or None'
+        if not userID:
+            return None
+        try:
+            ifile = open(os.path.join(self.wikiDir, 'data', 'user', userID))
+        except IOError:
+            return None
+        try:
+            for line in ifile:
+                if line.startswith('name='):
+                    return line[5:].strip().decode('utf-8', 'replace')
+        finally:
+            ifile.close()
+
+    def open_revision(self, doc_id, revID=None):
+        'open Moin markup file of specified revision (default: current)'
         if revID is None:
             ifile = open(os.path.join(self.wikiDir, 'data', 'pages', doc_id,
                                       'current'))
@@ -34,8 +79,12 @@ class Repo(object):
                 revID = ifile.read().strip()
             finally:
                 ifile.close()
-        ifile = open(os.path.join(self.wikiDir, 'data', 'pages', doc_id, 'revisions',
-                                  revID))
+        return open(os.path.join(self.wikiDir, 'data', 'pages', doc_id,
+                                 'revisions', revID))
+
+    def get_document(self, doc_id, revID=None):
+        'retrieve the specified post or page and convert to ReST'
+        ifile = self.open_revision(doc_id, revID)
         try:
             rest = StringIO()
             convert_moin_to_rest(ifile, rest)
@@ -44,22 +93,22 @@ class Repo(object):
         doc = core.Document(rest=rest.getvalue())
         return doc, {} # no metadata
 
+    def save_document(self, doc_id, path, revID=None):
+        '''convert the specified page revision to ReST, streaming it into
+        file path, so memory use does not grow with page size.
+        Returns its attr dict, with its gitpubHash'''
+        ifile = self.open_revision(doc_id, revID)
+        try:
+            ofile = core.HashingWriter(path)
+            try:
+                convert_moin_to_rest(ifile, ofile)
+            finally:
+                ofile.close()
+        finally:
+            ifile.close()
+        return dict(gitpubHash=ofile.hexdigest())
 
 
-def re_replace(pattern, formatter, line):
-    hits = [m for m in pattern.finditer(line)]
-    if len(hits) == 0:
-        return line
-    # replace all cases of the pattern
-    newline = ''
-    lastpos = 0
-    for m in hits:
-        rep = formatter(m.group(0))
-        newline += line[lastpos:m.start()] + rep
-        lastpos = m.end()
-    newline += line[lastpos:]
-    return newline
-
 def rest_url(s):
     'reformat moin link to restructured text link'
     t = s[2:-2].split('|')
@@ -76,26 +125,43 @@ def rest_internal_link(s):
     #anonymousLinks.append(link)
     return ':doc:`%s <%s>`' % (text,link)
 
+# (pattern, formatter, marker) applied in order, each to the output of
+# the one before.  A pattern only matches lines containing its marker
+# substring, so lines without it skip that pass (None: always apply).
 moinReformatters = [
-    (re.compile(r"\$\$.+?\$\$"), lambda s: ":math:`%s`" % s[2:-2]),
-    (re.compile(r"'''''.+?'''''"), lambda s: "**%s**" %s[5:-5]),
-    (re.compile(r"'''.+?'''"), lambda s: "**%s**" %s[3:-3]),
-    (re.compile(r"''.+?''"), lambda s: "*%s*" %s[2:-2]),
-    (re.compile(r"{{{.+?}}}"), lambda s: "``%s``" %s[3:-3]),
+    (re.compile(r"\$\$.+?\$\$"), lambda s: ":math:`%s`" % s[2:-2], '$$'),
+    (re.compile(r"'''''.+?'''''"), lambda s: "**%s**" %s[5:-5], "'''''"),
+    (re.compile(r"'''.+?'''"), lambda s: "**%s**" %s[3:-3], "'''"),
+    (re.compile(r"''.+?''"), lambda s: "*%s*" %s[2:-2], "''"),
+    (re.compile(r"{{{.+?}}}"), lambda s: "``%s``" %s[3:-3], '{{{'),
     (re.compile(r"\[\[[A-Z]+[a-z0-9]+[A-Z][A-Za-z0-9]+\|.+?\]\]"),
-     rest_internal_link),
+     rest_internal_link, '[['),
     (re.compile(r"\[\[[A-Z]+[a-z0-9]+[A-Z][A-Za-z0-9]+\]\]"),
-     lambda s: ':doc:`%s`' % s[2:-2]),
-    (re.compile(r"\[\[.+?\]]"), rest_url),
+     lambda s: ':doc:`%s`' % s[2:-2], '[['),
+    (re.compile(r"\[\[.+?\]]"), rest_url, '[['),
     (re.compile(r"\b[A-Z]+[a-z0-9]+[A-Z][A-Za-z0-9]+[^>A-Za-z0-9]"),
-     lambda s: ' :doc:`%s`%s' % (s[:-1],s[-1])),
+     lambda s: ' :doc:`%s`%s' % (s[:-1],s[-1]), None),
 ]
 
 def reformat_line(line):
-    for pattern,rep in moinReformatters: # apply inline substitutions
-        line = re_replace(pattern, rep, line)
+    '''apply inline substitutions, skipping any pattern whose marker
+    is absent, with sub() rather than rebuilding the line in Python'''
+    for pattern, rep, marker in moinReformatters:
+        if marker is None or marker in line:
+            line = pattern.sub(lambda m: rep(m.group(0)), line)
     return line
 
+wrapWhitespace = re.compile(r'[\t\n\x0b\x0c\r]') # textwrap converts these
+
+def fill(text, initial_indent='', subsequent_indent='', width=70):
+    '''textwrap.fill(), skipping its slow word splitting when text
+    already fits on one line and has no whitespace it would change'''
+    if len(initial_indent) + len(text) <= width and text == text.strip() \
+           and not wrapWhitespace.search(text):
+        return text and initial_indent + text
+    return textwrap.fill(text, width, initial_indent=initial_indent,
+                         subsequent_indent=subsequent_indent)
+
 def convert_moin_to_rest(moinFile, outfile):
     'converts moin markup to restructured text, but very minimal'
     headers = ('=', '#', '-', '_', '^', '+', '.')
@@ -129,8 +195,8 @@ def convert_moin_to_rest(moinFile, outfile):
                 firstIndent -= 1
             line = line.lstrip(' *0123456789.') # find beginning of text
             line = reformat_line(line)
-            newline = textwrap.fill(firstChar + ' ' + line.strip(),
-                                    initial_indent=' ' * firstIndent,
+            newline = fill(firstChar + ' ' + line.strip(),
+                           initial_indent=' ' * firstIndent,
                     subsequent_indent=' ' * (firstIndent + len(firstChar) + 1))
             print >>outfile, '\n' + newline            
         else:
@@ -142,9 +208,8 @@ def convert_moin_to_rest(moinFile, outfile):
             line = line.lstrip()
             nspace = n - len(line)
             line = reformat_line(line)
-            newline = textwrap.fill(line.strip(),
-                                    initial_indent=' ' * nspace,
-                                    subsequent_indent=' ' * nspace)
+            newline = fill(line.strip(), initial_indent=' ' * nspace,
+                           subsequent_indent=' ' * nspace)
             print >>outfile, '\n' + newline
             if codePos >= 0:
                 outfile.write(codeLine)
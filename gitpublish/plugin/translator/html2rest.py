@@ -25,7 +25,8 @@ import sys
 import os
 import re
 import codecs
-from sgmllib import SGMLParser
+import markupbase
+from sgmllib import SGMLParser, SGMLParseError
 from StringIO import StringIO
 from textwrap import TextWrapper
 
@@ -55,54 +56,87 @@ def unescape(text):
             except KeyError:
                 pass
         return text # leave as is
+    if '&' not in text: # nothing to do, so skip the regex scan
+        return text
     return re.sub("&#?\w+;", fixup, text)
 
 class LineBuffer(object):
+    '''Lines of wrapped text.  indent() just records the indentation in a
+    difference array (_delta[i] is the change in indentation from line
+    i-1 to line i), and read() applies it in one pass, so indenting
+    costs O(1) however many lines are buffered or nesting levels apply'''
 
     def __init__(self):
         self._lines = []
+        self._delta = [0]
         self._wrapper = TextWrapper()
 
     def __len__(self):
         return len(self._lines)
 
+    def _get_indent(self, i):
+        'pending indentation of line i'
+        n = len(self._lines)
+        if i < 0:
+            i += n
+        if i == n - 1: # common case: last line
+            return -self._delta[n] # since _delta sums to zero
+        return sum(self._delta[:i + 1])
+
     def __getitem__(self, i):
-        return self._lines[i]
+        return ' ' * self._get_indent(i) + self._lines[i]
 
     def __setitem__(self, i, value):
+        'replace line i by value, including its indentation'
+        if i < 0:
+            i += len(self._lines)
+        indent = self._get_indent(i)
+        if indent: # value already contains any indentation it needs
+            self._delta[i] -= indent
+            self._delta[i + 1] += indent
         self._lines[i] = value
 
     def clear(self):
         self._lines[:] = []
+        self._delta[:] = [0]
 
     def read(self):
-        return '\n'.join(self._lines)
+        indent = 0
+        l = []
+        for line, delta in zip(self._lines, self._delta):
+            indent += delta
+            if indent:
+                line = ' ' * indent + line
+            l.append(line)
+        return '\n'.join(l)
+
+    def _extend(self, lines):
+        self._lines.extend(lines)
+        self._delta.extend([0] * len(lines))
 
     def write(self, s):
         #normalise whitespace
         s = ' '.join(s.split())
-        self._lines.extend(self._wrapper.wrap(s))
+        self._extend(self._wrapper.wrap(s))
 
     def rawwrite(self, s):
-        self._lines.extend(s.splitlines())
+        self._extend(s.splitlines())
 
     def indent(self, numspaces=4, start=0):
-        linebuf = self._lines
-        n = len(linebuf)
+        n = len(self._lines)
         if n > start:
-            indent = ' ' * numspaces
-            for i in range(start, n):
-                linebuf[i] = indent + linebuf[i]
+            self._delta[start] += numspaces
+            self._delta[n] -= numspaces
 
     def lstrip(self):
-        linebuf = self._lines
-        for i in range(len(linebuf)):
-            linebuf[i] = linebuf[i].lstrip()
+        self._lines = [line.lstrip() for line in self._lines]
+        self._delta = [0] * len(self._delta)
 
-class Parser(SGMLParser):
+class RestHandler(object):
+    '''HTML to ReST conversion handlers, called by a tokenizer: either
+    SGMLParser (see Parser) or our own single-pass one (see StreamParser)'''
 
     def __init__(self, writer=sys.stdout):
-        SGMLParser.__init__(self)
         self.writer = writer
         self.stringbuffer = StringIO()
         self.linebuffer = LineBuffer()
@@ -113,10 +147,6 @@ class Parser(SGMLParser):
         self.nobreak = False
         self.link = None
 
-    def close(self):
-        self.writeline()
-        SGMLParser.close(self)
-
     def flush(self):
         if self.linebuffer:
             if self.inblock > 1:
@@ -362,8 +392,280 @@ class Parser(SGMLParser):
     def end_body(self):
         self.end_p()
 
+
+class Parser(RestHandler, SGMLParser):
+    'HTML to ReST converter based on sgmllib.SGMLParser'
+
+    def __init__(self, writer=sys.stdout):
+        SGMLParser.__init__(self)
+        RestHandler.__init__(self, writer)
+
+    def close(self):
+        self.writeline()
+        SGMLParser.close(self)
+
+
+# same token syntax as sgmllib
+shorttagopen = re.compile('<[a-zA-Z][-.a-zA-Z0-9]*/')
+shorttag = re.compile('<([a-zA-Z][-.a-zA-Z0-9]*)/([^/]*)/')
+starttagopen = re.compile('<[>a-zA-Z]')
+endbracket = re.compile('[<>]')
+tagfind = re.compile('[a-zA-Z][-_.a-zA-Z0-9]*')
+attrfind = re.compile(
+    r'\s*([a-zA-Z_][-:.a-zA-Z_0-9]*)(\s*=\s*'
+    r'(\'[^\']*\'|"[^"]*"|[][\-a-zA-Z0-9./,:;+*%?!&$\(\)_#=~\'"@]*))?')
+entity_or_charref = re.compile('&(?:([a-zA-Z][-.a-zA-Z0-9]*)|#([0-9]+))(;?)')
+incomplete = re.compile('&([a-zA-Z][a-zA-Z0-9]*|#[0-9]*)?|'
+                        '<([a-zA-Z][^<>]*|/([a-zA-Z][^<>]*)?|![^<>]*)?')
+# one alternative per common token; anything else goes to parse_other()
+tokenRE = re.compile(r'''
+ (?P<text>[^&<]+)
+|(?P<starttag><(?P<tag>[a-zA-Z][-_.a-zA-Z0-9]*)(?P<attrs>[^<>]*)(?=[<>]))
+|(?P<endtag></(?P<endname>[^<>]*)(?=[<>]))
+|(?P<charref>&\#(?P<charnum>[0-9]+)(?:;|(?=[^0-9])))
+|(?P<entityref>&(?P<entname>[a-zA-Z][-.a-zA-Z0-9]*)(?:;|(?=[^a-zA-Z0-9])))
+''', re.VERBOSE)
+entityTail = re.compile('[-.a-zA-Z0-9]*')
+entitydefs = {'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"', 'apos': '\''}
+
+def convert_charref(name):
+    'ASCII character for decimal charref, else None (like sgmllib)'
+    n = int(name)
+    if 0 <= n <= 127:
+        return chr(n)
+
+def _convert_ref(m):
+    'convert entity or charref in attribute value (like sgmllib)'
+    if m.group(2):
+        return convert_charref(m.group(2)) or '&#%s%s' % m.groups()[1:]
+    elif m.group(3):
+        return entitydefs.get(m.group(1)) or '&%s;' % m.group(1)
+    else:
+        return '&%s' % m.group(1)
+
+
+class StreamParser(RestHandler, markupbase.ParserBase):
+    '''HTML to ReST converter with a single-pass regex tokenizer, and
+    start_* / end_* handlers looked up in dicts built once per parser.
+    Its output is identical to Parser\'s, since it follows sgmllib\'s
+    handling of broken markup, entities and unclosed tags.  Input can
+    be fed in chunks of any size'''
+    _decl_otherchars = '='
+
+    def __init__(self, writer=sys.stdout):
+        RestHandler.__init__(self, writer)
+        self.reset()
+        self.rawdata = ''
+        self.stack = []
+        self.lasttag = '???'
+        self.startHandlers = {}
+        self.endHandlers = {}
+        for name in dir(self):
+            if name.startswith('start_'):
+                self.startHandlers[name[6:]] = getattr(self, name)
+            elif name.startswith('end_'):
+                self.endHandlers[name[4:]] = getattr(self, name)
+
+    def feed(self, data):
+        'parse as much of data as possible; keep the rest for the next call'
+        self.rawdata += data
+        self.goahead(True)
+
+    def close(self):
+        self.goahead(False) # text at the end is complete
+        self.writeline()
+        self.goahead(False, True)
+
+    def error(self, message):
+        raise SGMLParseError(message)
+
+    def goahead(self, holdText, end=False):
+        '''tokenize rawdata, stopping at an incomplete token.  If holdText,
+        also keep trailing text, since the next feed() may extend it.
+        If end, whatever is left is treated as text'''
+        rawdata = self.rawdata
+        i = 0
+        n = len(rawdata)
+        match = tokenRE.match
+        while i < n:
+            m = match(rawdata, i)
+            if m is None: # markup that needs a closer look
+                k = self.parse_other(i)
+                if k < 0:
+                    break
+                i = k
+                continue
+            kind = m.lastgroup
+            if kind == 'text':
+                k = m.end()
+                if k == n and holdText:
+                    break
+                self.handle_data(m.group())
+                i = k
+            elif kind == 'starttag':
+                if m.group('attrs')[:1] == '/' and shorttagopen.match(rawdata, i):
+                    k = self.parse_starttag(i)
+                    if k < 0:
+                        break
+                    i = k
+                    continue
+                tag = m.group('tag').lower()
+                self.lasttag = tag
+                i = m.end()
+                if m.group('attrs'):
+                    attrs = self.parse_attrs(m.start('attrs'), i)
+                else:
+                    attrs = []
+                if rawdata[i] == '>':
+                    i += 1
+                self.finish_starttag(tag, attrs)
+            elif kind == 'endtag':
+                i = m.end()
+                if rawdata[i] == '>':
+                    i += 1
+                self.finish_endtag(m.group('endname').strip().lower())
+            elif kind == 'charref':
+                c = convert_charref(m.group('charnum'))
+                if c is not None: # otherwise ignore it, like sgmllib
+                    self.handle_data(c)
+                i = m.end()
+            else: # entityref
+                k = m.end()
+                if holdText and rawdata[k - 1] != ';' and \
+                       entityTail.match(rawdata, k).end() == n:
+                    break # more data could still extend its name
+                c = entitydefs.get(m.group('entname'))
+                if c is not None:
+                    self.handle_data(c)
+                i = m.end()
+        if end and i < n:
+            self.handle_data(rawdata[i:n])
+            i = n
+        self.rawdata = rawdata[i:]
+
+    def parse_other(self, i):
+        '''handle token at i that tokenRE could not, exactly as sgmllib
+        would.  Returns position after it, or -1 if incomplete'''
+        rawdata = self.rawdata
+        if rawdata[i] == '<':
+            if starttagopen.match(rawdata, i):
+                return self.parse_starttag(i)
+            if rawdata.startswith('</', i):
+                return -1 # no closing bracket yet
+            if rawdata.startswith('<!--', i):
+                return self.parse_comment(i)
+            if rawdata.startswith('<?', i):
+                j = rawdata.find('>', i + 2)
+                if j < 0:
+                    return -1
+                return j + 1 # processing instruction ignored
+            if rawdata.startswith('<!', i):
+                return self.parse_declaration(i)
+        m = incomplete.match(rawdata, i)
+        if not m:
+            self.handle_data(rawdata[i])
+            return i + 1
+        j = m.end()
+        if j == len(rawdata):
+            return -1
+        self.handle_data(rawdata[i:j])
+        return j
+
+    def parse_starttag(self, i):
+        'handle <tag/data/ and <> start tags; return end, or -1 if incomplete'
+        rawdata = self.rawdata
+        if shorttagopen.match(rawdata, i): # <tag/data/ == <tag>data</tag>
+            m = shorttag.match(rawdata, i)
+            if not m:
+                return -1
+            tag, data = m.group(1, 2)
+            tag = tag.lower()
+            self.finish_starttag(tag, [])
+            self.handle_data(data)
+            self.finish_endtag(tag)
+            return m.end()
+        m = endbracket.search(rawdata, i + 1)
+        if not m:
+            return -1
+        j = m.start()
+        if rawdata[i:i + 2] == '<>': # <> == last open tag seen
+            k = j
+            tag = self.lasttag
+        else:
+            k = tagfind.match(rawdata, i + 1).end()
+            tag = rawdata[i + 1:k].lower()
+            self.lasttag = tag
+        attrs = self.parse_attrs(k, j)
+        if rawdata[j] == '>':
+            j += 1
+        self.finish_starttag(tag, attrs)
+        return j
+
+    def parse_attrs(self, k, j):
+        'get [(name, value)] for attributes between k and j in rawdata'
+        rawdata = self.rawdata
+        attrs = []
+        while k < j:
+            m = attrfind.match(rawdata, k)
+            if not m:
+                break
+            attrname, rest, attrvalue = m.group(1, 2, 3)
+            if not rest:
+                attrvalue = attrname
+            else:
+                if (attrvalue[:1] == "'" == attrvalue[-1:] or
+                    attrvalue[:1] == '"' == attrvalue[-1:]):
+                    attrvalue = attrvalue[1:-1] # strip quotes
+                attrvalue = entity_or_charref.sub(_convert_ref, attrvalue)
+            attrs.append((attrname.lower(), attrvalue))
+            k = m.end()
+        return attrs
+
+    def finish_starttag(self, tag, attrs):
+        try:
+            method = self.startHandlers[tag]
+        except KeyError:
+            self.unknown_starttag(tag, attrs)
+        else:
+            self.stack.append(tag)
+            method(attrs)
+
+    def finish_endtag(self, tag):
+        'call end handlers, closing any tags left open inside this one'
+        stack = self.stack
+        if not tag:
+            found = len(stack) - 1
+            if found < 0:
+                self.unknown_endtag(tag)
+                return
+        else:
+            if tag not in stack:
+                if tag not in self.endHandlers:
+                    self.unknown_endtag(tag)
+                return # ignore unbalanced end tag
+            found = len(stack) - 1 # innermost open tag of this type
+            while stack[found] != tag:
+                found -= 1
+        while len(stack) > found:
+            method = self.endHandlers.get(stack[-1])
+            if method:
+                method()
+            else:
+                self.unknown_endtag(stack[-1])
+            del stack[-1]
+
+    def handle_comment(self, data):
+        pass
+
+    def handle_decl(self, data):
+        pass
+
+    def unknown_decl(self, data):
+        pass
+
+
 def html2rest(html, writer=sys.stdout):
-    parser = Parser(writer)
+    parser = StreamParser(writer)
     parser.feed(html)
     parser.close()
 
@@ -178,13 +178,16 @@ class HtmlTranslatorBase(html4css1.HTMLTranslator):
 	def visit_image(self, node):
 		'''rewrite local path to its path on remote, or if that
 		fails, add document to unresolved refs list.'''
+		uri = node['uri']
 		try:
-			d = self.gitpubDoc.relative_path(node['uri'])
+			d = self.gitpubDoc.relative_path(uri)
 			node['uri'] = d['gitpubRemotePath'] # use path on remote
+			self.gitpubRefs[uri] = node['uri']
 		except KeyError: # not yet present in mapping, so resolve later
 			self.gitpubUnresolvedRefs.add(self.gitpubDoc)
+			self.gitpubRefs[uri] = None
 		except TypeError: # no docmap?
-			pass
+			self.gitpubRefs[uri] = None
 		html4css1.HTMLTranslator.visit_image(self, node)
 
 class WpHtmlTranslator(HtmlTranslatorBase):
@@ -205,9 +208,12 @@ class Writer(html4css1.Writer):
 	def __init__(self, doc=None, unresolvedRefs=None,
 		     klass=WpHtmlTranslator):
 		html4css1.Writer.__init__(self)
+		self.gitpubTranslator = klass
+		self.gitpubRefs = refs = {} # image uri: remote path it was given
 		class MyWpHtmlTranslator(klass):
 			gitpubDoc = doc
 			gitpubUnresolvedRefs = unresolvedRefs
+			gitpubRefs = refs
 		self.translator_class = MyWpHtmlTranslator
 
 
@@ -0,0 +1,123 @@
+import xmlrpclib
+import httplib
+import threading
+from gitpublish import core
+
+
+class PooledTransport(xmlrpclib.Transport):
+    '''XMLRPC transport that keeps HTTP/1.1 connections alive and shares
+    a small pool of them between threads.  Each request checks out an idle
+    connection to its host (or opens a new one, up to maxConnections
+    in use at once), and returns it to the pool afterwards.
+    stats counts opened / reused / closed connections and requests, and
+    get_bytes() gives the bytes sent and received by the calling thread.'''
+    connectionClass = httplib.HTTPConnection
+
+    def __init__(self, maxConnections=4, use_datetime=0):
+        xmlrpclib.Transport.__init__(self, use_datetime)
+        self.maxConnections = maxConnections
+        self._slots = threading.BoundedSemaphore(maxConnections)
+        self._lock = threading.Lock()
+        self._idle = [] # (host, connection) pairs ready for reuse
+        self._local = threading.local() # connection checked out by this thread
+        self.stats = dict(opened=0, reused=0, closed=0, requests=0)
+
+    def _count(self, k):
+        with self._lock:
+            self.stats[k] += 1
+
+    @core.PhaseTimer('rpc')
+    def request(self, host, handler, request_body, verbose=0):
+        'send request over a pooled connection, waiting for a free slot'
+        self._slots.acquire()
+        try:
+            self._local.host = host
+            self._local.connection = self._checkout(host)
+            self._count('requests')
+            self._add_bytes('sent', len(request_body))
+            try:
+                result = xmlrpclib.Transport.request(self, host, handler,
+                                                     request_body, verbose)
+            except xmlrpclib.Fault: # server answered, connection still good
+                self._checkin()
+                raise
+            except: # connection state unknown, so don't reuse it
+                self.close()
+                raise
+            self._checkin()
+            return result
+        finally:
+            self._slots.release()
+
+    def _add_bytes(self, k, n):
+        setattr(self._local, k, getattr(self._local, k, 0) + n)
+
+    def get_bytes(self):
+        '(sent, received) request / response body bytes of this thread so far'
+        return (getattr(self._local, 'sent', 0),
+                getattr(self._local, 'received', 0))
+
+    def parse_response(self, response):
+        'count the response bytes that xmlrpclib reads'
+        return xmlrpclib.Transport.parse_response(self,
+                                        _CountingResponse(response, self))
+
+    def _checkout(self, host):
+        'get an idle connection to host, or None'
+        with self._lock:
+            for i, (h, connection) in enumerate(self._idle):
+                if h == host:
+                    del self._idle[i]
+                    self.stats['reused'] += 1
+                    return connection
+        return None
+
+    def _checkin(self):
+        'return this thread\'s connection to the idle pool'
+        connection = self._local.connection
+        self._local.connection = None
+        if connection is not None:
+            with self._lock:
+                self._idle.append((self._local.host, connection))
+
+    def make_connection(self, host):
+        'return connection checked out by this thread, opening one if needed'
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            chost, self._extra_headers, x509 = self.get_host_info(host)
+            connection = self.connectionClass(chost)
+            self._local.connection = connection
+            self._count('opened')
+        return connection
+
+    def close(self):
+        'discard this thread\'s connection (xmlrpclib calls this on errors)'
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            self._local.connection = None
+            connection.close()
+            self._count('closed')
+
+    def close_all(self):
+        'close all idle connections in the pool'
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for host, connection in idle:
+            connection.close()
+            self._count('closed')
+
+
+class _CountingResponse(object):
+    'wraps an HTTPResponse, adding bytes read to its transport\'s count'
+    def __init__(self, response, transport):
+        self._response = response
+        self._transport = transport
+
+    def read(self, *args):
+        data = self._response.read(*args)
+        self._transport._add_bytes('received', len(data))
+        return data
+
+    def __getattr__(self, attr):
+        return getattr(self._response, attr)
@@ -1,17 +1,23 @@
 import xmlrpclib
-from docutils.core import publish_string
 from translator import html2rest, rst2wp
+from transport import PooledTransport
 from gitpublish import core
 import warnings
 
 class Repo(core.RepoBase):
+    listPageSize = 100 # docs per wp.getPosts listing request
+    listFields = ['post_id', 'post_title', 'post_modified', 'post_modified_gmt']
+    maxRecentPosts = 2000 # posts to ask for from pre-3.4 getRecentPosts
+
     def __init__(self, host, user, password=None, blog_id=0, path='/xmlrpc.php',
-                 appkey=None):
+                 appkey=None, maxConnections=4, batchSize=0):
         core.RepoBase.__init__(self, host, user, password, blog_id)
         url = 'http://' + host + path
-        self.server = xmlrpclib.ServerProxy(url)
+        self.transport = PooledTransport(int(maxConnections))
+        self.server = xmlrpclib.ServerProxy(url, transport=self.transport)
         self.path = path
         self.appkey = appkey
+        self.batchSize = int(batchSize) # >1 means push via system.multicall
 
     def new_post(self, title, content, publish=True):
         'create post with specified title and HTML content'
@@ -35,7 +41,7 @@ class Repo(core.RepoBase):
 
     def get_post(self, post_id):
         'get HTML and attr dictionary for this post'
-        result = self.server.metaWeblog.getPost(pub_id, self.user,
+        result = self.server.metaWeblog.getPost(post_id, self.user,
                                                 self.password)
         html = result['description'] + result['mt_text_more']
         del result['description'] # don't duplicate the content
@@ -77,21 +83,170 @@ class Repo(core.RepoBase):
         warnings.warn('wordpress lacks file deletion function... ignoring.')
         return True # don't treat as XMLRPC error
 
-    def get_post_list(self, maxposts=2000):
-        return self.server.metaWeblog.getRecentPosts(self.blog_id,
-                    self.user, self.password, maxposts)
+    def get_post_list(self, maxposts=None):
+        'generate attr dict for each post, up to maxposts (None means all)'
+        return self._get_post_type_list('post', maxposts,
+                                        lambda: self._get_recent_posts(maxposts))
+
+    def _get_recent_posts(self, maxposts=None):
+        'list posts via getRecentPosts, which can only return the newest ones'
+        l = self.server.metaWeblog.getRecentPosts(self.blog_id, self.user,
+                        self.password, maxposts or self.maxRecentPosts)
+        if maxposts is None and len(l) >= self.maxRecentPosts:
+            warnings.warn('getRecentPosts returned %d posts, so older posts '
+                          'may be missing (upgrade to WordPress 3.4+ to '
+                          'list them all)' % len(l))
+        return l
+
+    def get_page_list(self, maxpages=None):
+        'generate attr dict for each page, up to maxpages (None means all)'
+        return self._get_post_type_list('page', maxpages,
+            lambda: self.server.wp.getPageList(self.blog_id, self.user,
+                                               self.password))
 
-    def get_page_list(self, maxpages=2000):
-        'maxpages ignored currently...'
-        return self.server.wp.getPageList(self.blog_id, self.user,
-                                          self.password)
+    def _get_post_type_list(self, post_type, maxposts, fallback):
+        '''page through wp.getPosts, listPageSize docs per request, asking
+        only for listFields.  Falls back to the old full-content listing
+        call fallback() if the server lacks wp.getPosts (WordPress < 3.4)'''
+        offset = 0
+        while maxposts is None or offset < maxposts:
+            n = self.listPageSize
+            if maxposts is not None:
+                n = min(n, maxposts - offset)
+            f = dict(post_type=post_type, number=n, offset=offset,
+                     orderby='ID', order='ASC') # stable order for paging
+            try:
+                l = self.server.wp.getPosts(self.blog_id, self.user,
+                                            self.password, f, self.listFields)
+            except xmlrpclib.Fault:
+                if offset: # wp.getPosts worked before, so a real error
+                    raise
+                for d in fallback():
+                    yield d
+                return
+            for d in l:
+                yield d
+            if len(l) < n: # no more
+                return
+            offset += len(l)
     
+    def multicall(self, calls):
+        '''send list of (methodName, args) as one system.multicall request.
+        Returns list of results, with the Fault for each call that failed'''
+        if not calls:
+            return []
+        mc = xmlrpclib.MultiCall(self.server)
+        for methodName, args in calls:
+            getattr(mc, methodName)(*args)
+        results = mc()
+        l = []
+        for i in range(len(calls)):
+            try:
+                l.append(results[i])
+            except xmlrpclib.Fault, e: # report this call's fault to caller
+                l.append(e)
+        return l
+
+    def _run_batch(self, results, calls, handlers):
+        'send calls via multicall, and store handler(value) in results'
+        for (i, call), handler, v in zip(calls, handlers,
+                                         self.multicall([c for i, c in calls])):
+            if isinstance(v, xmlrpclib.Fault):
+                results[i] = v
+            else:
+                results[i] = handler(v)
+        return results
+
+    def new_documents(self, jobs, unresolvedRefs=None):
+        '''create a batch of docs in one request.  jobs is a list of
+        (doc, docDict) pairs.  Returns list of dicts as from new_document(),
+        or an exception for each doc that failed'''
+        self.check_password()
+        results = [None] * len(jobs)
+        calls = []
+        handlers = []
+        for i, (doc, docDict) in enumerate(jobs):
+            if not hasattr(doc, 'rest'): # binary files are uploaded singly
+                try:
+                    results[i] = self.upload_file(doc)
+                except xmlrpclib.Fault, e:
+                    results[i] = e
+                continue
+            html = self.get_html(doc, docDict.get('gitpubHash'), unresolvedRefs)
+            d = dict(title=doc.title, description=html)
+            publish = docDict.get('publish', True)
+            if docDict.get('pubtype', 'post') == 'page':
+                calls.append((i, ('wp.newPage', (self.blog_id, self.user,
+                                                 self.password, d, publish))))
+                pubtype = 'page:'
+            else:
+                calls.append((i, ('metaWeblog.newPost', (self.blog_id,
+                                  self.user, self.password, d, publish))))
+                pubtype = 'post:'
+            handlers.append(lambda v, pubtype=pubtype:
+                            dict(gitpubID=pubtype + str(v),
+                                 gitpubRemotePath='/?p=' + str(v)))
+        return self._run_batch(results, calls, handlers)
+
+    def set_documents(self, jobs, unresolvedRefs=None):
+        '''update a batch of docs in one request.  jobs is a list of
+        (doc_id, doc, docDict) tuples.  Returns list of None (or dict of
+        updated attrs), or an exception for each doc that failed'''
+        self.check_password()
+        results = [None] * len(jobs)
+        calls = []
+        for i, (doc_id, doc, docDict) in enumerate(jobs):
+            pubtype, pub_id = self._get_pubtype_id(doc_id)
+            if pubtype == 'file': # binary files are uploaded singly
+                try:
+                    results[i] = self.upload_file(doc, doc_id)
+                except xmlrpclib.Fault, e:
+                    results[i] = e
+                continue
+            elif pubtype not in ('page', 'post'):
+                results[i] = ValueError('unknown pubtype: %s' % pubtype)
+                continue
+            html = self.get_html(doc, docDict.get('gitpubHash'), unresolvedRefs)
+            d = dict(title=doc.title, description=html)
+            publish = docDict.get('publish', True)
+            if pubtype == 'page':
+                calls.append((i, ('wp.editPage', (self.blog_id, pub_id,
+                                   self.user, self.password, d, publish))))
+            else:
+                calls.append((i, ('metaWeblog.editPost', (pub_id, self.user,
+                                   self.password, d, publish))))
+        return self._run_batch(results, calls,
+                               [_check_result] * len(calls))
+
+    def delete_documents(self, doc_ids):
+        '''delete a batch of docs in one request.  Returns list of None,
+        or an exception for each doc that failed'''
+        self.check_password()
+        results = [None] * len(doc_ids)
+        calls = []
+        for i, doc_id in enumerate(doc_ids):
+            pubtype, pub_id = self._get_pubtype_id(doc_id)
+            if pubtype == 'page':
+                calls.append((i, ('wp.deletePage', (self.blog_id, self.user,
+                                                    self.password, pub_id))))
+            elif pubtype == 'post':
+                self.check_password('appkey')
+                calls.append((i, ('blogger.deletePost', (self.appkey, pub_id,
+                                  self.user, self.password, True))))
+            elif pubtype == 'file':
+                self.delete_file(doc_id)
+            else:
+                results[i] = ValueError('unknown pubtype: %s' % pubtype)
+        return self._run_batch(results, calls,
+                               [_check_result] * len(calls))
+
     def convert_rest(self, doc, unresolvedRefs=None):
         'convert ReST to WP html using docutils, rst2wp'
         writer = rst2wp.Writer(doc, unresolvedRefs)
-        return publish_string(doc.rest, writer=writer, # wordpress format
-                              settings_overrides=dict(report_level=5))
+        return self.render_rest(doc, writer) # wordpress format
 
 
-
-    
+def _check_result(v):
+    'map a false return value from an XMLRPC method to an error'
+    if not v:
+        return ValueError('xmlrpc server method failed: check your args')
@@ -0,0 +1,254 @@
+'''In-process stand-in for a WordPress XML-RPC server, for exercising
+the wordpress plugin offline, e.g.
+
+  server = start_server()
+  repoArgs = dict(host=server.hostname, user='admin', password='x')
+
+keeps posts, pages and uploaded files in memory, and counts calls.
+Server can add latency, cap bandwidth and inject faults, to test and
+benchmark concurrency, batching and retries without a live blog.
+'''
+
+import random
+import SocketServer
+import threading
+import time
+import xmlrpclib
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+
+class WordPressStore(object):
+    '''in-memory blog implementing the XML-RPC methods that the wordpress
+    plugin calls.  Posts and pages share one ID sequence, as in WP'''
+    def __init__(self, host):
+        self.host = host
+        self.lock = threading.Lock()
+        self.docs = {} # post_id string to attr dict
+        self.files = {} # upload URL to data
+        self.nextID = 1
+        self.clock = 0 # post_modified time, always advanced on each change
+        self.calls = {} # method name to number of calls
+
+    def get_methods(self):
+        'map XML-RPC method names to our implementations'
+        return {'metaWeblog.newPost': self.new_post,
+                'metaWeblog.editPost': self.edit_post,
+                'metaWeblog.getPost': self.get_post,
+                'metaWeblog.getRecentPosts': self.get_recent_posts,
+                'wp.newPage': self.new_page,
+                'wp.editPage': self.edit_page,
+                'wp.editPost': self.wp_edit_post,
+                'wp.getPage': self.get_page,
+                'wp.getPageList': self.get_page_list,
+                'wp.getPosts': self.get_posts,
+                'wp.deletePage': self.delete_page,
+                'wp.uploadFile': self.upload_file,
+                'blogger.deletePost': self.delete_post}
+
+    def count(self, methodName):
+        with self.lock:
+            self.calls[methodName] = self.calls.get(methodName, 0) + 1
+
+    def total_calls(self):
+        'number of method calls so far, counting each call in a multicall'
+        with self.lock:
+            return sum(self.calls.values())
+
+    def _tick(self):
+        'next modification time, distinct even for changes in one second'
+        self.clock = max(self.clock + 1, int(time.time()))
+        return xmlrpclib.DateTime(time.gmtime(self.clock))
+
+    def _new(self, post_type, d, publish):
+        with self.lock:
+            post_id = str(self.nextID)
+            self.nextID += 1
+            self.docs[post_id] = dict(post_id=post_id, post_type=post_type,
+                                      title=d.get('title', ''),
+                                      description=d.get('description', ''),
+                                      post_status=publish and 'publish'
+                                      or 'draft', post_modified=self._tick())
+        return post_id
+
+    def _get(self, post_type, post_id):
+        try:
+            d = self.docs[str(post_id)]
+        except KeyError:
+            raise xmlrpclib.Fault(404, 'Invalid post ID.')
+        if d['post_type'] != post_type:
+            raise xmlrpclib.Fault(404, 'Invalid post ID.')
+        return d
+
+    def _edit(self, post_type, post_id, title, content, publish=True):
+        with self.lock:
+            d = self._get(post_type, post_id)
+            d.update(title=title, description=content,
+                     post_status=publish and 'publish' or 'draft',
+                     post_modified=self._tick())
+        return True
+
+    def _delete(self, post_type, post_id):
+        with self.lock:
+            self._get(post_type, post_id)
+            del self.docs[str(post_id)]
+        return True
+
+    def _get_dict(self, d, idKey):
+        'attr dict for doc d, as getPost / getPage return it'
+        return {idKey: d['post_id'], 'title': d['title'],
+                'description': d['description'], 'mt_text_more': '',
+                'post_status': d['post_status'],
+                'date_modified': d['post_modified'],
+                'link': 'http://%s/?p=%s' % (self.host, d['post_id'])}
+
+    def _list(self, post_type):
+        with self.lock:
+            return sorted([d for d in self.docs.values()
+                           if d['post_type'] == post_type],
+                          key=lambda d: int(d['post_id']))
+
+    def new_post(self, blog_id, user, password, d, publish):
+        return self._new('post', d, publish)
+
+    def new_page(self, blog_id, user, password, d, publish):
+        return self._new('page', d, publish)
+
+    def edit_post(self, post_id, user, password, d, publish):
+        return self._edit('post', post_id, d.get('title', ''),
+                          d.get('description', ''), publish)
+
+    def wp_edit_post(self, blog_id, user, password, post_id, content):
+        return self._edit('post', post_id, content.get('post_title', ''),
+                          content.get('post_content', ''))
+
+    def edit_page(self, blog_id, page_id, user, password, d, publish):
+        return self._edit('page', page_id, d.get('title', ''),
+                          d.get('description', ''), publish)
+
+    def get_post(self, post_id, user, password):
+        with self.lock:
+            return self._get_dict(self._get('post', post_id), 'postid')
+
+    def get_page(self, blog_id, page_id, user, password):
+        with self.lock:
+            return self._get_dict(self._get('page', page_id), 'page_id')
+
+    def get_recent_posts(self, blog_id, user, password, n):
+        l = self._list('post')[::-1][:n] # newest first
+        with self.lock:
+            return [self._get_dict(d, 'postid') for d in l]
+
+    def get_page_list(self, blog_id, user, password):
+        return [dict(page_id=d['post_id'], page_title=d['title'],
+                     date_modified=d['post_modified'])
+                for d in self._list('page')]
+
+    def get_posts(self, blog_id, user, password, f=None, fields=None):
+        'wp.getPosts, supporting the post_type, number and offset filters'
+        f = f or {}
+        offset = f.get('offset', 0)
+        l = self._list(f.get('post_type', 'post'))[offset:
+                                                   offset + f.get('number', 10)]
+        results = []
+        for d in l:
+            r = dict(post_id=d['post_id'], post_title=d['title'],
+                     post_type=d['post_type'], post_status=d['post_status'],
+                     post_content=d['description'],
+                     post_modified=d['post_modified'],
+                     post_modified_gmt=d['post_modified'])
+            if fields:
+                r = dict([(k, r[k]) for k in r
+                          if k in fields or k == 'post_id'])
+            results.append(r)
+        return results
+
+    def delete_page(self, blog_id, user, password, page_id):
+        return self._delete('page', page_id)
+
+    def delete_post(self, appkey, post_id, user, password, publish):
+        return self._delete('post', post_id)
+
+    def upload_file(self, blog_id, user, password, content):
+        url = 'http://%s/wp-content/uploads/%s' % (self.host, content['name'])
+        with self.lock:
+            self.files[url] = content['bits'].data
+        return dict(file=content['name'], url=url, type=content['type'])
+
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/xmlrpc.php',)
+    protocol_version = 'HTTP/1.1' # keep connections alive, as WP servers do
+
+
+class Server(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
+    '''XML-RPC server on /xmlrpc.php, dispatching to a WordPressStore,
+    one thread per connection.  To mimic a slow or overloaded blog:
+    latency: seconds added to every HTTP request (network round trip)
+    callTime: seconds added to every method call, including each call
+              within a system.multicall (server-side work)
+    bandwidth: bytes/sec cap on each request plus its response
+    faultRate: fraction of method calls that fail with Fault(faultCode),
+               chosen by a random generator seeded with seed'''
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0., callTime=0.,
+                 bandwidth=None, faultRate=0., faultCode=503, seed=0):
+        SimpleXMLRPCServer.__init__(self, (host, port), RequestHandler,
+                                    logRequests=False, allow_none=True)
+        self.hostname = '%s:%d' % self.server_address # for repoArgs host=
+        self.latency = latency
+        self.callTime = callTime
+        self.bandwidth = bandwidth
+        self.faultRate = faultRate
+        self.faultCode = faultCode
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0 # HTTP requests, i.e. a multicall counts once
+        self.faults = 0 # injected faults
+        self.bytes = 0 # request plus response bodies
+        self.store = WordPressStore(self.hostname)
+        for methodName, func in self.store.get_methods().items():
+            self.register_function(func, methodName)
+        self.register_multicall_functions()
+
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        'count request, then delay its response by latency and bandwidth'
+        with self.lock:
+            self.requests += 1
+        response = SimpleXMLRPCServer._marshaled_dispatch(self, data,
+                                                          dispatch_method, path)
+        nbytes = len(data) + len(response)
+        with self.lock:
+            self.bytes += nbytes
+        delay = self.latency
+        if self.bandwidth:
+            delay += float(nbytes) / self.bandwidth
+        if delay:
+            time.sleep(delay)
+        return response
+
+    def _dispatch(self, method, params):
+        if method == 'system.multicall': # count and delay the calls it contains
+            return SimpleXMLRPCServer._dispatch(self, method, params)
+        self.store.count(method)
+        if self.callTime:
+            time.sleep(self.callTime)
+        if self.faultRate:
+            with self.lock:
+                fail = self.random.random() < self.faultRate
+                if fail:
+                    self.faults += 1
+            if fail:
+                raise xmlrpclib.Fault(self.faultCode,
+                                      'injected fault in %s' % method)
+        return SimpleXMLRPCServer._dispatch(self, method, params)
+
+
+def start_server(host='127.0.0.1', port=0, **kwargs):
+    '''start a Server in a daemon thread, and return it.
+    kwargs are passed to Server, e.g. latency=0.05'''
+    server = Server(host, port, **kwargs)
+    t = threading.Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+    return server